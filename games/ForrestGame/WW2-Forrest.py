@@ -9,8 +9,13 @@
 
 import math
 import random
+import numpy as np
 import pygame
 
+from entities import EntityPool, EntityStore
+from spatial import SpatialHash
+from sprites import SpriteCache, prepare
+
 pygame.init()
 
 WIDTH, HEIGHT = 900, 700
@@ -27,6 +32,28 @@ ENEMY_TYPES = {
 	'mercenary': {'hp':3000, 'xp':500, 'gold':1500, 'color':(50,200,50), 'damage':1.0},
 }
 
+# Enemy store rows keep an index into ENEMY_KINDS; the boss is a fourth
+# kind that pays out and hits like a mercenary
+ENEMY_KINDS = ['soldier', 'general', 'mercenary', 'boss']
+ENEMY_STATS = [ENEMY_TYPES[k] for k in ENEMY_KINDS[:3]] + [ENEMY_TYPES['mercenary']]
+ENEMY_RADIUS = [12, 20, 28, 60]
+ENEMY_SPEED = [40, 25, 15, 8.0]
+ENEMY_COLOR = [stats['color'] for stats in ENEMY_STATS[:3]] + [(120,20,160)]
+ENEMY_DAMAGE = np.array([stats['damage'] for stats in ENEMY_STATS])
+BOSS = ENEMY_KINDS.index('boss')
+BOSS_HP = 5000000
+
+ALLY_HP = 1000
+ALLY_RADIUS = 10
+BULLET_RADIUS = 4
+BULLET_POOL = 4096
+MISSILE_RADIUS = 6
+
+# Unit sprites and health bars, drawn once and blitted from then on
+SPRITES = SpriteCache()
+# Fade levels pre-rendered per explosion radius
+EXPLOSION_ALPHA_STEPS = 32
+
 # Weapons: name, cost, base_damage, unlock_level
 WEAPONS = [
 	{'name':'Pistol','cost':0,'damage':10,'unlock_level':1},
@@ -75,67 +102,6 @@ class Player(pygame.sprite.Sprite):
 		return int(base * 3 * (1.2 ** up))
 
 
-class Bullet(pygame.sprite.Sprite):
-	def __init__(self, x, y, vx, vy, damage):
-		super().__init__()
-		self.x = x
-		self.y = y
-		self.vx = vx
-		self.vy = vy
-		self.damage = damage
-		self.radius = 4
-
-	def update(self, dt):
-		self.x += self.vx * dt
-		self.y += self.vy * dt
-		if self.x < -50 or self.y < -50 or self.x > WIDTH+50 or self.y > HEIGHT+50:
-			self.kill()
-
-	def draw(self, surf):
-		pygame.draw.circle(surf, (255,220,0), (int(self.x), int(self.y)), self.radius)
-
-
-class Enemy(pygame.sprite.Sprite):
-	def __init__(self, etype, x, y):
-		super().__init__()
-		self.type = etype
-		data = ENEMY_TYPES[etype]
-		self.hp = data['hp']
-		self.max_hp = data['hp']
-		self.color = data['color']
-		self.x = x
-		self.y = y
-		self.radius = 12 if etype=='soldier' else (20 if etype=='general' else 28)
-
-	def rect(self):
-		return pygame.Rect(self.x-self.radius, self.y-self.radius, self.radius*2, self.radius*2)
-
-	def update(self, dt, castle):
-		# move towards castle
-		dx = castle['x'] - self.x
-		dy = castle['y'] - self.y
-		dist = math.hypot(dx,dy) + 1e-6
-		speed = 40 if self.type=='soldier' else (25 if self.type=='general' else 15)
-		self.x += dx/dist * speed * dt
-		self.y += dy/dist * speed * dt
-
-	def draw(self, surf):
-		# draw humanoid enemy: head and body
-		head_r = max(5, self.radius//2)
-		head_x = int(self.x)
-		head_y = int(self.y - self.radius//1.5)
-		body_w = int(self.radius * 1.2)
-		body_h = int(self.radius * 1.3)
-		body_rect = pygame.Rect(int(self.x - body_w/2), int(self.y - body_h/2), body_w, body_h)
-		pygame.draw.rect(surf, self.color, body_rect)
-		pygame.draw.circle(surf, (220,200,170), (head_x, head_y), head_r)
-		# hp bar
-		bar_w = self.radius*2
-		hp_ratio = max(0, self.hp/self.max_hp)
-		pygame.draw.rect(surf, (50,50,50), (self.x-self.radius, self.y-self.radius-8, bar_w, 5))
-		pygame.draw.rect(surf, (0,200,0), (self.x-self.radius, self.y-self.radius-8, int(bar_w*hp_ratio), 5))
-
-
 class Missile(pygame.sprite.Sprite):
 	def __init__(self, x, y, vx, vy, owner=None):
 		super().__init__()
@@ -144,7 +110,7 @@ class Missile(pygame.sprite.Sprite):
 		self.vx = vx
 		self.vy = vy
 		self.owner = owner
-		self.radius = 6
+		self.radius = MISSILE_RADIUS
 
 	def update(self, dt):
 		self.x += self.vx * dt
@@ -157,6 +123,16 @@ class Missile(pygame.sprite.Sprite):
 		pygame.draw.circle(surf, (200,120,50), (int(self.x), int(self.y)), self.radius)
 
 
+def explosion_frames(radius):
+	# every fade level of one explosion size, from invisible to opaque
+	frames = []
+	for step in range(EXPLOSION_ALPHA_STEPS + 1):
+		s = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA)
+		pygame.draw.circle(s, (255,140,0, 255 * step // EXPLOSION_ALPHA_STEPS), (radius, radius), radius)
+		frames.append(prepare(s))
+	return frames
+
+
 class Explosion(pygame.sprite.Sprite):
 	def __init__(self, x, y, radius=60, life=0.6):
 		super().__init__()
@@ -164,6 +140,8 @@ class Explosion(pygame.sprite.Sprite):
 		self.y = y
 		self.radius = radius
 		self.life = life
+		# shared by every explosion of this size
+		self.frames = SPRITES.get(('explosion', radius), lambda: explosion_frames(radius))
 
 	def update(self, dt):
 		self.life -= dt
@@ -172,85 +150,181 @@ class Explosion(pygame.sprite.Sprite):
 
 	def draw(self, surf):
 		alpha = max(0, min(255, int(255 * (self.life / 0.6))))
-		s = pygame.Surface((self.radius*2, self.radius*2), pygame.SRCALPHA)
-		pygame.draw.circle(s, (255,140,0, alpha), (self.radius, self.radius), self.radius)
-		surf.blit(s, (int(self.x-self.radius), int(self.y-self.radius)))
-
-
-class Boss(Enemy):
-	def __init__(self, x, y):
-		super().__init__('mercenary', x, y)
-		self.radius = 60
-		self.hp = 5000000
-		self.max_hp = 5000000
-		self.color = (120,20,160)
-		self.shoot_timer = 0.0
-		self.speed = 8.0  # advance much slower
-
-	def update(self, dt, castle):
-		# slow advance to castle
-		dx = castle['x'] - self.x
-		dy = castle['y'] - self.y
-		dist = math.hypot(dx,dy) + 1e-6
-		self.x += dx/dist * self.speed * dt
-		self.y += dy/dist * self.speed * dt
-		# shooting handled externally via spawn in main loop
-
-	def draw(self, surf):
+		frame = self.frames[(alpha * EXPLOSION_ALPHA_STEPS + 127) // 255]
+		surf.blit(frame, (int(self.x-self.radius), int(self.y-self.radius)))
+
+
+# Enemies and allies live in EntityStores and bullets in an EntityPool (see
+# entities.py): one array per attribute, updated a whole column at a time
+def make_enemies():
+	return EntityStore({'x': float, 'y': float, 'hp': float, 'max_hp': float,
+		'radius': np.int32, 'type': np.int8, 'speed': float})
+
+
+def make_allies():
+	return EntityStore({'x': float, 'y': float, 'hp': float, 'cooldown': float})
+
+
+def make_bullets():
+	return EntityPool({'x': float, 'y': float, 'vx': float, 'vy': float, 'damage': float}, BULLET_POOL)
+
+
+def add_enemy(enemies, etype, x, y):
+	kind = ENEMY_KINDS.index(etype)
+	hp = BOSS_HP if kind == BOSS else ENEMY_TYPES[etype]['hp']
+	enemies.add(x=x, y=y, hp=hp, max_hp=hp, radius=ENEMY_RADIUS[kind], type=kind, speed=ENEMY_SPEED[kind])
+
+
+def reward(player, kind):
+	stats = ENEMY_STATS[kind]
+	player.gold += stats['gold']
+	player.xp += stats['xp']
+
+
+def update_bullets(bullets, dt):
+	# moves free slots too, which is cheaper than picking out the live ones
+	bullets.x += bullets.vx * dt
+	bullets.y += bullets.vy * dt
+	x, y = bullets.x, bullets.y
+	gone = (x < -50) | (y < -50) | (x > WIDTH+50) | (y > HEIGHT+50)
+	bullets.release(np.flatnonzero(gone & bullets.alive))
+
+
+def move_enemies(enemies, castle, dt):
+	# every enemy walks straight at the castle
+	dx = castle['x'] - enemies.x
+	dy = castle['y'] - enemies.y
+	step = enemies.speed * dt / (np.hypot(dx, dy) + 1e-6)
+	enemies.x += dx * step
+	enemies.y += dy * step
+
+
+def allies_shoot(allies, bullets, dt, mx, my, firing):
+	# Allies shoot toward the mouse when the player is firing, everyone
+	# whose cooldown ran out in one volley.
+	allies.cooldown -= dt
+	if not firing:
+		return
+	ready = np.flatnonzero(allies.cooldown <= 0)
+	if not len(ready):
+		return
+	allies.cooldown[ready] = np.random.uniform(0.12, 0.4, len(ready))
+	x = allies.x[ready]
+	y = allies.y[ready]
+	# aim at mouse position
+	dx = mx - x
+	dy = my - y
+	dist = np.hypot(dx, dy) + 1e-6
+	dx /= dist
+	dy /= dist
+	speed_b = 700
+	bullets.spawn(len(ready), x=x + dx*(ALLY_RADIUS + 6), y=y + dy*(ALLY_RADIUS + 6),
+		vx=dx*speed_b, vy=dy*speed_b, damage=50)
+
+
+def shoot_enemies(bullets, enemies, grid, player):
+	# each bullet hits the first enemy row it touches that is still standing
+	grid.build(enemies.x, enemies.y, enemies.radius)
+	live = bullets.live()
+	bx = bullets.x[live]
+	by = bullets.y[live]
+	bi, ei = grid.pairs(bx, by, BULLET_RADIUS)
+	touching = np.hypot(bx[bi] - enemies.x[ei], by[bi] - enemies.y[ei]) < BULLET_RADIUS + enemies.radius[ei]
+	bi = live[bi]
+	hp = enemies.hp
+	damage = bullets.damage
+	spent = []
+	killed = set()
+	for b, e in zip(bi[touching].tolist(), ei[touching].tolist()):
+		if (spent and spent[-1] == b) or e in killed:
+			continue
+		spent.append(b)
+		hp[e] -= damage[b]
+		if hp[e] <= 0:
+			killed.add(e)
+			reward(player, int(enemies.type[e]))
+	bullets.release(spent)
+	enemies.remove(list(killed))
+
+
+def circle_sprite(color, radius):
+	surface = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA)
+	pygame.draw.circle(surface, color, (radius, radius), radius)
+	return prepare(surface), radius, radius
+
+
+def enemy_sprite(kind):
+	# (surface, x offset, y offset) with the offsets locating the unit's centre
+	radius = ENEMY_RADIUS[kind]
+	if kind == BOSS:
 		# big boss
-		pygame.draw.circle(surf, self.color, (int(self.x), int(self.y)), self.radius)
-		# hp bar above
+		return circle_sprite(ENEMY_COLOR[kind], radius)
+	# humanoid enemy: head and body
+	head_r = max(5, radius//2)
+	head_up = int(radius//1.5)
+	body_w = int(radius * 1.2)
+	body_h = int(radius * 1.3)
+	half_w = max(body_w//2, head_r) + 1
+	top = head_up + head_r + 1
+	surface = pygame.Surface((half_w*2, top + body_h//2 + 1), pygame.SRCALPHA)
+	pygame.draw.rect(surface, ENEMY_COLOR[kind], (half_w - body_w//2, top - body_h//2, body_w, body_h))
+	pygame.draw.circle(surface, (220,200,170), (half_w, top - head_up), head_r)
+	return prepare(surface), half_w, top
+
+
+def draw_bullets(surf, bullets):
+	live = bullets.live()
+	sprite, ox, oy = SPRITES.get('bullet', lambda: circle_sprite((255,220,0), BULLET_RADIUS))
+	xs = (bullets.x[live] - ox).astype(int).tolist()
+	ys = (bullets.y[live] - oy).astype(int).tolist()
+	surf.blits([(sprite, pos) for pos in zip(xs, ys)], False)
+
+
+def draw_bars(surf, xs, ys, filled, width, height, color):
+	bar = SPRITES.bar
+	surf.blits([(bar(width, height, f, color), (x, y)) for x, y, f in zip(xs.tolist(), ys.tolist(), filled.tolist())], False)
+
+
+def draw_enemies(surf, enemies):
+	sprites = [SPRITES.get(('enemy', kind), lambda kind=kind: enemy_sprite(kind)) for kind in range(len(ENEMY_KINDS))]
+	xs = enemies.x.astype(int).tolist()
+	ys = enemies.y.astype(int).tolist()
+	blits = []
+	for kind, x, y in zip(enemies.type.tolist(), xs, ys):
+		sprite, ox, oy = sprites[kind]
+		blits.append((sprite, (x - ox, y - oy)))
+	surf.blits(blits, False)
+
+	# hp bars, only for the wounded
+	hurt = np.flatnonzero(enemies.hp < enemies.max_hp)
+	if not len(hurt):
+		return
+	x = enemies.x[hurt]
+	y = enemies.y[hurt]
+	radius = enemies.radius[hurt]
+	ratio = np.maximum(0, enemies.hp[hurt] / enemies.max_hp[hurt])
+	boss = enemies.type[hurt] == BOSS
+	if boss.any():
 		bar_w = 200
-		hp_ratio = max(0, self.hp/self.max_hp)
-		pygame.draw.rect(surf, (50,50,50), (int(self.x-bar_w/2), int(self.y-self.radius-18), bar_w, 8))
-		pygame.draw.rect(surf, (200,30,30), (int(self.x-bar_w/2), int(self.y-self.radius-18), int(bar_w*hp_ratio), 8))
-
-
-class Ally(pygame.sprite.Sprite):
-	def __init__(self, x, y):
-		super().__init__()
-		self.x = x
-		self.y = y
-		self.hp = 1000
-		self.max_hp = 1000
-		self.radius = 10
-		self.color = (180,180,240)
-		self.shoot_cooldown = random.uniform(0.3, 0.9)
-
-	def update(self, dt, player):
-		# follow player loosely
-		# allies will orbit / hold position near the castle; player passed but we ignore it here
-		# keep as-is for compatibility (no movement) unless far from spawn point
-		pass
-
-	def try_shoot(self, dt, mx, my, bullets, firing):
-		# Allies shoot toward the mouse when the player is firing.
-		self.shoot_cooldown -= dt
-		if not firing:
-			return
-		if self.shoot_cooldown > 0:
-			return
-		self.shoot_cooldown = random.uniform(0.12, 0.4)
-		# aim at mouse position
-		dx = mx - self.x
-		dy = my - self.y
-		dist = math.hypot(dx, dy) + 1e-6
-		speed_b = 700
-		vx = dx/dist*speed_b
-		vy = dy/dist*speed_b
-		dmg = 50
-		spawn_x = self.x + dx/dist * (self.radius + 6)
-		spawn_y = self.y + dy/dist * (self.radius + 6)
-		bullets.add(Bullet(spawn_x, spawn_y, vx, vy, dmg))
-
-	def draw(self, surf):
-		# small humanoid
-		pygame.draw.circle(surf, self.color, (int(self.x), int(self.y)), self.radius)
-		# hp bar
-		bar_w = self.radius*2
-		hp_ratio = max(0, self.hp/self.max_hp)
-		pygame.draw.rect(surf, (50,50,50), (self.x-self.radius, self.y-self.radius-8, bar_w, 4))
-		pygame.draw.rect(surf, (100,200,100), (self.x-self.radius, self.y-self.radius-8, int(bar_w*hp_ratio), 4))
+		draw_bars(surf, (x[boss] - bar_w/2).astype(int), (y[boss] - radius[boss] - 18).astype(int),
+			(bar_w * ratio[boss]).astype(int), bar_w, 8, (200,30,30))
+	for r in np.unique(radius[~boss]).tolist():
+		same = ~boss & (radius == r)
+		draw_bars(surf, (x[same] - r).astype(int), (y[same] - r - 8).astype(int),
+			(r*2 * ratio[same]).astype(int), r*2, 5, (0,200,0))
+
+
+def draw_allies(surf, allies):
+	# small humanoid
+	sprite, ox, oy = SPRITES.get('ally', lambda: circle_sprite((180,180,240), ALLY_RADIUS))
+	xs = (allies.x - ox).astype(int).tolist()
+	ys = (allies.y - oy).astype(int).tolist()
+	surf.blits([(sprite, pos) for pos in zip(xs, ys)], False)
+	# hp bars, only for the wounded
+	hurt = np.flatnonzero(allies.hp < ALLY_HP)
+	bar_w = ALLY_RADIUS*2
+	draw_bars(surf, (allies.x[hurt] - ALLY_RADIUS).astype(int), (allies.y[hurt] - ALLY_RADIUS - 8).astype(int),
+		(bar_w * np.maximum(0, allies.hp[hurt] / ALLY_HP)).astype(int), bar_w, 4, (100,200,100))
 
 
 def draw_hud(surf, player, allies_count=0):
@@ -324,13 +398,15 @@ def main():
 	castle = {'x': WIDTH//2, 'y': HEIGHT//2, 'hp': 10000, 'max_hp': 10000, 'radius': 60}
 
 	player = Player(WIDTH//2 + 150, HEIGHT//2 + 150)
-	bullets = pygame.sprite.Group()
-	enemies = pygame.sprite.Group()
-	allies = []
+	bullets = make_bullets()
+	enemies = make_enemies()
+	allies = make_allies()
 	missiles = pygame.sprite.Group()
 	explosions = pygame.sprite.Group()
-	boss = None
 	boss_spawned = False
+	# collision broadphase, rebuilt every frame (see spatial.py)
+	ally_grid = SpatialHash()
+	enemy_grid = SpatialHash()
 
 	# spawn 500 allied soldiers arranged in concentric rings around the castle
 	for i in range(500):
@@ -338,7 +414,7 @@ def main():
 		radius_ring = 90 + (i % 5) * 6
 		rx = castle['x'] + math.cos(angle) * radius_ring
 		ry = castle['y'] + math.sin(angle) * radius_ring
-		allies.append(Ally(rx, ry))
+		allies.add(x=rx, y=ry, hp=ALLY_HP, cooldown=random.uniform(0.3, 0.9))
 
 	fire_rate = 0.25  # seconds
 	spawn_timer = 0.0
@@ -406,8 +482,7 @@ def main():
 			gun_length = player.radius + 12
 			spawn_x = player.x + dx/dist * gun_length
 			spawn_y = player.y + dy/dist * gun_length
-			b = Bullet(spawn_x, spawn_y, vx, vy, dmg)
-			bullets.add(b)
+			bullets.spawn(1, x=spawn_x, y=spawn_y, vx=vx, vy=vy, damage=dmg)
 			player.fire_cooldown = fire_rate
 
 		if player.fire_cooldown > 0:
@@ -432,8 +507,7 @@ def main():
 					bx, by = -200, HEIGHT//2
 				else:
 					bx, by = WIDTH+200, HEIGHT//2
-				boss = Boss(bx, by)
-				enemies.add(boss)
+				add_enemy(enemies, 'boss', bx, by)
 				boss_spawned = True
 				# also spawn some heavy waves around outer ring
 				for i in range(500):
@@ -441,7 +515,7 @@ def main():
 					r = 420 + random.randint(-40, 80)
 					x = castle['x'] + math.cos(a) * r
 					y = castle['y'] + math.sin(a) * r
-					enemies.add(Enemy('soldier', x, y))
+					add_enemy(enemies, 'soldier', x, y)
 				continue
 			# otherwise, sometimes spawn a large ring
 			if random.random() < 0.35:
@@ -451,7 +525,7 @@ def main():
 					a = (i / count) * (2 * math.pi)
 					x = castle['x'] + math.cos(a) * (radius_ring + random.uniform(-20,20))
 					y = castle['y'] + math.sin(a) * (radius_ring + random.uniform(-20,20))
-					enemies.add(Enemy('soldier', x, y))
+					add_enemy(enemies, 'soldier', x, y)
 				continue
 			# single spawn fallback
 			if player.level < 3:
@@ -475,15 +549,30 @@ def main():
 			else:
 				x = WIDTH + 30
 				y = random.randint(0, HEIGHT)
-			enemies.add(Enemy(type_choice, x, y))
+			add_enemy(enemies, type_choice, x, y)
 
 		# update bullets
-		for b in list(bullets):
-			b.update(dt)
+		update_bullets(bullets, dt)
+
+		# nothing moves between here and the enemy update, so these grids
+		# serve the missile and explosion checks
+		ally_grid.build(allies.x, allies.y, ALLY_RADIUS)
+		enemy_grid.build(enemies.x, enemies.y, enemies.radius)
 
-		# update missiles
+		# update missiles, then look up which of them touch an ally or an
+		# enemy with one grid query per population
 		for m in list(missiles):
 			m.update(dt)
+		flying = list(missiles)
+		missile_x = np.array([m.x for m in flying])
+		missile_y = np.array([m.y for m in flying])
+		mi, ai = ally_grid.pairs(missile_x, missile_y, MISSILE_RADIUS)
+		ally_hit = np.zeros(len(flying), bool)
+		ally_hit[mi[np.hypot(missile_x[mi]-allies.x[ai], missile_y[mi]-allies.y[ai]) < MISSILE_RADIUS + ALLY_RADIUS]] = True
+		mi, ei = enemy_grid.pairs(missile_x, missile_y, MISSILE_RADIUS)
+		enemy_hit = np.zeros(len(flying), bool)
+		enemy_hit[mi[np.hypot(missile_x[mi]-enemies.x[ei], missile_y[mi]-enemies.y[ei]) < MISSILE_RADIUS + enemies.radius[ei]]] = True
+		for m, hit_ally, hit_enemy in zip(flying, ally_hit.tolist(), enemy_hit.tolist()):
 			# missile collision with castle/player/allies/enemies -> explode
 			# castle
 			if math.hypot(m.x-castle['x'], m.y-castle['y']) < m.radius + castle['radius']:
@@ -497,19 +586,17 @@ def main():
 				m.kill()
 				continue
 			# allies
-			for a in list(allies):
-				if math.hypot(m.x-a.x, m.y-a.y) < m.radius + a.radius:
-					explosions.add(Explosion(m.x, m.y, radius=80))
-					m.kill()
-					break
+			if hit_ally:
+				explosions.add(Explosion(m.x, m.y, radius=80))
+				m.kill()
 			# enemies (missile hitting an enemy also explodes)
-			for e2 in list(enemies):
-				if math.hypot(m.x-e2.x, m.y-e2.y) < m.radius + e2.radius:
-					explosions.add(Explosion(m.x, m.y, radius=80))
-					m.kill()
-					break
+			if hit_enemy:
+				explosions.add(Explosion(m.x, m.y, radius=80))
+				m.kill()
 
-		# update explosions and apply damage once on creation
+		# update explosions and apply damage once on creation; the dead are
+		# only flagged here and removed after the loop
+		fallen = np.zeros(len(enemies), bool)
 		for ex in list(explosions):
 			ex.update(dt)
 			# apply damage immediately (only once) by checking a flag
@@ -525,84 +612,60 @@ def main():
 			if math.hypot(ex.x-player.x, ex.y-player.y) <= ex.radius:
 				player.health -= explosion_damage
 			# damage allies
-			for a in list(allies):
-				if math.hypot(ex.x-a.x, ex.y-a.y) <= ex.radius:
-					a.hp -= explosion_damage
-					if a.hp <= 0:
-						try:
-							allies.remove(a)
-						except ValueError:
-							pass
+			near = ally_grid.query(ex.x, ex.y, ex.radius)
+			near = near[(allies.hp[near] > 0) & (np.hypot(ex.x-allies.x[near], ex.y-allies.y[near]) <= ex.radius)]
+			allies.hp[near] -= explosion_damage
 			# damage enemies
-			for e3 in list(enemies):
-				if math.hypot(ex.x-e3.x, ex.y-e3.y) <= ex.radius:
-					e3.hp -= explosion_damage
-					if e3.hp <= 0:
-						r = ENEMY_TYPES[e3.type]
-						player.gold += r['gold']
-						player.xp += r['xp']
-						enemies.remove(e3)
+			near = enemy_grid.query(ex.x, ex.y, ex.radius)
+			near = near[~fallen[near] & (np.hypot(ex.x-enemies.x[near], ex.y-enemies.y[near]) <= ex.radius)]
+			enemies.hp[near] -= explosion_damage
+			near = near[enemies.hp[near] <= 0]
+			fallen[near] = True
+			for kind in enemies.type[near].tolist():
+				reward(player, kind)
 			# mark applied
 			ex.applied = True
+		enemies.remove(np.flatnonzero(fallen))
+		allies.remove(np.flatnonzero(allies.hp <= 0))
+		ally_grid.build(allies.x, allies.y, ALLY_RADIUS)
 
-		# update allies (they shoot toward mouse when player fires and die when hp <= 0)
-		for a in list(allies):
-			a.update(dt, player)
-			# allies follow the player's firing direction: pass mx,my and mouse state
-			a.try_shoot(dt, mx, my, bullets, mouse_pressed)
-			if a.hp <= 0:
-				try:
-					allies.remove(a)
-				except ValueError:
-					pass
+		# update allies (they shoot toward mouse when player fires)
+		allies_shoot(allies, bullets, dt, mx, my, mouse_pressed)
 
 		# update enemies
-		for e in list(enemies):
-			e.update(dt, castle)
-			# collision with castle
-			if math.hypot(e.x-castle['x'], e.y-castle['y']) < e.radius + castle['radius']:
-				dmg = ENEMY_TYPES[e.type]['damage']
-				castle['hp'] -= dmg
-				# knockback enemy a bit
-				ang = math.atan2(e.y-castle['y'], e.x-castle['x'])
-				e.x += math.cos(ang)*10
-				e.y += math.sin(ang)*10
-				# if castle falls, game over
-				if castle['hp'] <= 0:
-					running = False
-
-			# collision with allies
-			for a in list(allies):
-				if math.hypot(e.x-a.x, e.y-a.y) < e.radius + a.radius:
-					# enemy and ally trade damage
-					# ally takes enemy damage
-					a.hp -= ENEMY_TYPES[e.type]['damage']
-					# ally deals damage to enemy
-					e.hp -= 50
-					# knockback
-					ang2 = math.atan2(e.y-a.y, e.x-a.x)
-					e.x += math.cos(ang2)*8
-					e.y += math.sin(ang2)*8
-					if a.hp <= 0:
-						try:
-							allies.remove(a)
-						except ValueError:
-							pass
+		move_enemies(enemies, castle, dt)
+		# collision with castle
+		dx = enemies.x - castle['x']
+		dy = enemies.y - castle['y']
+		touching = np.flatnonzero(np.hypot(dx, dy) < enemies.radius + castle['radius'])
+		if len(touching):
+			castle['hp'] -= float(ENEMY_DAMAGE[enemies.type[touching]].sum())
+			# knockback enemy a bit
+			ang = np.arctan2(dy[touching], dx[touching])
+			enemies.x[touching] += np.cos(ang)*10
+			enemies.y[touching] += np.sin(ang)*10
+			# if castle falls, game over
+			if castle['hp'] <= 0:
+				running = False
 
+		# collision with allies: every touching pair trades damage at once
+		# and the knockbacks from several allies add up
+		ei, ai = ally_grid.pairs(enemies.x, enemies.y, enemies.radius)
+		dx = enemies.x[ei] - allies.x[ai]
+		dy = enemies.y[ei] - allies.y[ai]
+		touching = np.hypot(dx, dy) < enemies.radius[ei] + ALLY_RADIUS
+		ei, ai, dx, dy = ei[touching], ai[touching], dx[touching], dy[touching]
+		# ally takes enemy damage, ally deals damage to enemy
+		np.subtract.at(allies.hp, ai, ENEMY_DAMAGE[enemies.type[ei]])
+		np.subtract.at(enemies.hp, ei, 50)
+		# knockback
+		ang2 = np.arctan2(dy, dx)
+		np.add.at(enemies.x, ei, np.cos(ang2)*8)
+		np.add.at(enemies.y, ei, np.sin(ang2)*8)
+		allies.remove(np.flatnonzero(allies.hp <= 0))
 
 		# bullets -> enemies
-		for b in list(bullets):
-			for e in list(enemies):
-				if math.hypot(b.x-e.x, b.y-e.y) < b.radius + e.radius:
-					e.hp -= b.damage
-					b.kill()
-					if e.hp <= 0:
-						# reward
-						r = ENEMY_TYPES[e.type]
-						player.gold += r['gold']
-						player.xp += r['xp']
-						enemies.remove(e)
-					break
+		shoot_enemies(bullets, enemies, enemy_grid, player)
 
 		# update player level based on xp
 		prev_level = player.level
@@ -628,14 +691,14 @@ def main():
 		pygame.draw.rect(SCREEN, (40,40,40), (WIDTH//2 - hp_w//2, 12, hp_w, 18))
 		pygame.draw.rect(SCREEN, (200,50,50), (WIDTH//2 - hp_w//2, 12, int(hp_w*hp_ratio), 18))
 		# draw bullets
-		for b in bullets:
-			b.draw(SCREEN)
+		draw_bullets(SCREEN, bullets)
 		# draw allies
-		for a in allies:
-			a.draw(SCREEN)
+		draw_allies(SCREEN, allies)
 		# draw enemies
-		for e in enemies:
-			e.draw(SCREEN)
+		draw_enemies(SCREEN, enemies)
+		# draw explosions
+		for ex in explosions:
+			ex.draw(SCREEN)
 
 		draw_hud(SCREEN, player, len(allies))
 
@@ -0,0 +1,146 @@
+import numpy as np
+
+
+class EntityStore:
+	"""Structure-of-arrays storage: one NumPy column per attribute.
+
+	Row i of every column is entity i, so a whole population is updated
+	with a handful of array operations instead of a method call per
+	object. store.x, store.y and so on are views of the live rows and are
+	refreshed whenever rows are added or removed, so don't hold on to them
+	across those calls. Removal swaps rows in from the tail, which keeps
+	the rows packed but does not keep their order.
+	"""
+
+	def __init__(self, columns, capacity=1024):
+		self.columns = columns
+		self.data = {name: np.zeros(capacity, dtype) for name, dtype in columns.items()}
+		self.capacity = capacity
+		self.count = 0
+		self.refresh()
+
+	def __len__(self):
+		return self.count
+
+	def refresh(self):
+		for name, column in self.data.items():
+			setattr(self, name, column[:self.count])
+
+	def reserve(self, count):
+		if count <= self.capacity:
+			return
+		capacity = self.capacity
+		while capacity < count:
+			capacity *= 2
+		for name, column in self.data.items():
+			grown = np.zeros(capacity, column.dtype)
+			grown[:self.count] = column[:self.count]
+			self.data[name] = grown
+		self.capacity = capacity
+
+	def add(self, **values):
+		"""Append one row, columns left out are zero; returns its index"""
+		index = self.count
+		self.reserve(index + 1)
+		for name, column in self.data.items():
+			column[index] = values.get(name, 0)
+		self.count += 1
+		self.refresh()
+		return index
+
+	def add_many(self, count, **values):
+		"""Append count rows at once, each value is an array or a scalar"""
+		start = self.count
+		self.reserve(start + count)
+		for name, column in self.data.items():
+			column[start:start + count] = values.get(name, 0)
+		self.count += count
+		self.refresh()
+
+	def remove(self, indices):
+		"""Swap-remove rows: survivors from the tail fill the holes"""
+		indices = np.unique(indices)
+		if not len(indices):
+			return
+		count = self.count - len(indices)
+		holes = indices[indices < count]
+		tail = np.arange(count, self.count)
+		tail = tail[~np.isin(tail, indices)]
+		for column in self.data.values():
+			column[holes] = column[tail]
+		self.count = count
+		self.refresh()
+
+
+class EntityPool:
+	"""Preallocated slots for short-lived entities, reused through a free list.
+
+	Unlike EntityStore, rows never move: spawn() pops slots off the free
+	list and release() pushes them back, so spawning and expiring whole
+	batches is a couple of slice assignments and nothing is reallocated
+	while the pool has room. The columns are full-capacity arrays and
+	alive marks the slots in use; updating dead slots as well is harmless
+	since spawn() overwrites them. The pool doubles if it ever runs out.
+	"""
+
+	def __init__(self, columns, capacity=4096):
+		self.columns = columns
+		self.capacity = 0
+		self.alive = np.zeros(0, bool)
+		# Stack of free slots, top at free[free_count - 1], which starts out
+		# as slot 0 so the live slots stay packed at the low end
+		self.free = np.zeros(0, np.intp)
+		self.free_count = 0
+		for name, dtype in columns.items():
+			setattr(self, name, np.zeros(0, dtype))
+		self.grow(capacity)
+
+	def __len__(self):
+		return self.capacity - self.free_count
+
+	def grow(self, capacity):
+		old = self.capacity
+		for name in self.columns:
+			column = getattr(self, name)
+			grown = np.zeros(capacity, column.dtype)
+			grown[:old] = column
+			setattr(self, name, grown)
+		alive = np.zeros(capacity, bool)
+		alive[:old] = self.alive
+		self.alive = alive
+		new = capacity - old
+		free = np.zeros(capacity, np.intp)
+		# New slots go under the ones already free, lowest nearest the top
+		free[:new] = np.arange(capacity - 1, old - 1, -1)
+		free[new:new + self.free_count] = self.free[:self.free_count]
+		self.free = free
+		self.free_count += new
+		self.capacity = capacity
+
+	def live(self):
+		return np.flatnonzero(self.alive)
+
+	def spawn(self, count, **values):
+		"""Fill count free slots, each value is an array or a scalar; returns the slots"""
+		if count > self.free_count:
+			capacity = self.capacity
+			while capacity - len(self) < count:
+				capacity *= 2
+			self.grow(capacity)
+		self.free_count -= count
+		slots = self.free[self.free_count:self.free_count + count][::-1].copy()
+		for name in self.columns:
+			getattr(self, name)[slots] = values.get(name, 0)
+		self.alive[slots] = True
+		return slots
+
+	def release(self, slots):
+		"""Give slots back to the free list, ones already free are ignored"""
+		slots = np.unique(slots).astype(np.intp)
+		slots = slots[self.alive[slots]]
+		if not len(slots):
+			return
+		self.alive[slots] = False
+		# Highest first, so the lowest released slot ends up on top
+		self.free[self.free_count:self.free_count + len(slots)] = slots[::-1]
+		self.free_count += len(slots)
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+
+# Cell keys are cx * KEY_STRIDE + cy, unique as long as |cy| stays below half of it
+KEY_STRIDE = 1 << 32
+EMPTY = np.zeros(0, np.intp)
+
+
+class SpatialHash:
+	"""Uniform grid over the rows of an EntityStore, rebuilt every frame.
+
+	build() sorts the rows by the cell their centre falls in, so each cell
+	is a contiguous run of the sorted order and is found with
+	searchsorted. A query looks at every cell within its radius plus the
+	largest item radius, which makes the candidates a superset of what can
+	overlap it; callers still run their exact distance test on them. Items
+	bigger than a cell (the boss) would widen every query, so they are
+	kept aside and returned as candidates for every query instead.
+	"""
+
+	def __init__(self, cell_size=32):
+		self.cell_size = cell_size
+		self.keys = EMPTY
+		self.order = EMPTY
+		self.large = EMPTY
+		self.max_radius = 0.0
+
+	def cell(self, values):
+		return np.floor(np.asarray(values) / self.cell_size).astype(np.int64)
+
+	def build(self, x, y, radius):
+		radius = np.broadcast_to(radius, np.shape(x))
+		small = radius <= self.cell_size
+		self.large = np.flatnonzero(~small)
+		index = np.flatnonzero(small)
+		keys = self.cell(x[index]) * KEY_STRIDE + self.cell(y[index])
+		# Stable, so rows in the same cell stay in row order
+		order = np.argsort(keys, kind="stable")
+		self.keys = keys[order]
+		self.order = index[order]
+		self.max_radius = float(radius[index].max()) if len(index) else 0.0
+
+	def pairs(self, x, y, radius):
+		"""Candidate (query, item) index arrays for many circles at once.
+
+		Pairs come out sorted by query, then by item.
+		"""
+		x = np.atleast_1d(x)
+		y = np.atleast_1d(y)
+		radius = np.broadcast_to(radius, x.shape)
+		if not len(x) or not (len(self.order) or len(self.large)):
+			return EMPTY, EMPTY
+
+		queries = []
+		items = []
+		if len(self.order):
+			reach = int(math.ceil((float(radius.max()) + self.max_radius) / self.cell_size))
+			cx = self.cell(x)
+			cy = self.cell(y)
+			for dx in range(-reach, reach + 1):
+				for dy in range(-reach, reach + 1):
+					keys = (cx + dx) * KEY_STRIDE + (cy + dy)
+					start = np.searchsorted(self.keys, keys, "left")
+					counts = np.searchsorted(self.keys, keys, "right") - start
+					total = int(counts.sum())
+					if not total:
+						continue
+					# One entry per (query, item in its cell): repeat each query
+					# count times and walk its run of the sorted order
+					query = np.repeat(np.arange(len(x)), counts)
+					first = np.cumsum(counts) - counts
+					queries.append(query)
+					items.append(self.order[start[query] + np.arange(total) - first[query]])
+		if len(self.large):
+			queries.append(np.repeat(np.arange(len(x)), len(self.large)))
+			items.append(np.tile(self.large, len(x)))
+		if not queries:
+			return EMPTY, EMPTY
+
+		queries = np.concatenate(queries)
+		items = np.concatenate(items)
+		order = np.lexsort((items, queries))
+		return queries[order], items[order]
+
+	def query(self, x, y, radius):
+		"""Candidate item indices for one circle, in row order"""
+		return self.pairs(x, y, radius)[1]
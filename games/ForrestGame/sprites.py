@@ -0,0 +1,47 @@
+import pygame
+
+
+def prepare(surface):
+	# Match the display's pixel format so blits don't convert every time
+	if pygame.display.get_surface() is None:
+		return surface
+	if surface.get_flags() & pygame.SRCALPHA:
+		return surface.convert_alpha()
+	return surface.convert()
+
+
+class SpriteCache:
+	"""Surfaces drawn once and blitted many times per frame.
+
+	Units of one kind all look the same, so each is rendered onto its own
+	surface the first time it is needed and the frame is then a single
+	Surface.blits call instead of several pygame.draw calls per unit.
+	Health bars are cached by how many pixels are filled, which is all
+	that can differ between two bars of the same size.
+	"""
+
+	def __init__(self):
+		self.surfaces = {}
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.surfaces)
+
+	def get(self, key, make):
+		"""The cached value for key, made with make() the first time"""
+		value = self.surfaces.get(key)
+		if value is not None:
+			self.hits += 1
+			return value
+		self.misses += 1
+		value = self.surfaces[key] = make()
+		return value
+
+	def bar(self, width, height, filled, color, back=(50,50,50)):
+		def make():
+			surface = pygame.Surface((width, height))
+			surface.fill(back)
+			surface.fill(color, (0, 0, filled, height))
+			return prepare(surface)
+		return self.get(('bar', width, height, filled, color, back), make)
@@ -0,0 +1,515 @@
+# Micro-benchmarks for the Island Adventure multiplayer code
+# Usage: python benchmarks.py <name> [--count N]
+
+import argparse
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+from journal import Journal
+from leaderboard import Leaderboard
+from server import ISLANDS, GameServer
+from textcache import TextCache
+from topics import TopicIndex
+from protocol import CODECS, FrameDecoder, encode_frame, encode_message, encode_payload, decode_message, decode_messages
+
+BENCHMARKS = {}
+
+SAMPLE_MESSAGES = {
+    "achievement": {"type": "achievement", "player": "Player1", "message": "Defeated an enemy! +42 gold"},
+    "encounter": {
+        "type": "encounter",
+        "player": "Player1",
+        "encounter": {"type": "combat", "description": "A fierce goblin attacks!"}
+    },
+    "player_list": {
+        "type": "player_list",
+        "version": 1234,
+        "full": True,
+        "players": [
+            {"id": str(i), "name": f"Player{i}", "gold": i * 37, "health": 100 - i % 50, "level": 1 + i // 10}
+            for i in range(50)
+        ],
+        "removed": []
+    },
+    "leaderboard": {
+        "type": "leaderboard",
+        "board": [[f"Player{i}", 5000 - i * 37, 120 - i] for i in range(50)],
+        "rank": 7
+    },
+}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def report(label, count, elapsed, extra=""):
+    rate = count / elapsed if elapsed else float("inf")
+    print(f"  {label:<28} {count:>9} msgs  {elapsed:8.3f}s  {rate:>12,.0f} msgs/s  {extra}")
+
+
+def stream_messages(payloads, receive):
+    # Blast pre-encoded payloads through a local socket pair and time the reader
+    writer, reader = socket.socketpair()
+
+    def send_all():
+        for payload in payloads:
+            writer.sendall(payload)
+        writer.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send_all)
+    start = time.perf_counter()
+    sender.start()
+    result = receive(reader)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    writer.close()
+    reader.close()
+    return result, elapsed
+
+
+@benchmark("framing")
+def bench_framing(args):
+    message = SAMPLE_MESSAGES["achievement"]
+    print(f"Sending {args.count} '{message['type']}' messages over a local socket pair")
+
+    # Old protocol: bare JSON per send, one recv(1024) per message
+    def receive_raw(sock):
+        decoded = errors = 0
+        while True:
+            data = sock.recv(1024)
+            if not data:
+                break
+            try:
+                json.loads(data.decode())
+                decoded += 1
+            except ValueError:
+                # Coalesced or split reads, the server drops the player here
+                errors += 1
+        return decoded, errors
+
+    raw = [json.dumps(message).encode()] * args.count
+    (decoded, errors), elapsed = stream_messages(raw, receive_raw)
+    report("raw json", decoded, elapsed, f"({errors} reads failed to parse)")
+
+    def receive_framed(sock):
+        decoder = FrameDecoder()
+        decoded = 0
+        while decoded < args.count and decoder.recv_into(sock):
+            for payload in decoder.frames():
+                decode_message(payload)
+                decoded += 1
+        return decoded
+
+    framed = [encode_message(message)] * args.count
+    decoded, elapsed = stream_messages(framed, receive_framed)
+    report("length-prefixed frames", decoded, elapsed)
+
+
+@benchmark("codec")
+def bench_codec(args):
+    count = max(1, args.count // 10)
+    print(f"Encoding and decoding each message {count} times")
+    for name in ("player_list", "leaderboard", "encounter"):
+        message = SAMPLE_MESSAGES[name]
+        for codec in CODECS:
+            payload = encode_payload(message, codec)
+            assert decode_message(payload) == message
+
+            start = time.perf_counter()
+            for _ in range(count):
+                encode_payload(message, codec)
+            encode_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(count):
+                decode_message(payload)
+            decode_time = time.perf_counter() - start
+
+            print(f"  {name:<12} {codec:<7} {len(payload):>6} bytes  "
+                  f"encode {encode_time / count * 1e6:7.2f}us  decode {decode_time / count * 1e6:7.2f}us")
+
+
+@benchmark("leaderboard")
+def bench_leaderboard(args):
+    player_count = 10000
+    attacks = args.count
+    queries = max(1, attacks // 100)
+    print(f"{player_count} players, {attacks} attacks, {queries} leaderboard requests (top 10 + own rank)")
+
+    rng = random.Random(1)
+    events = [(rng.randrange(player_count), rng.randint(10, 50)) for _ in range(attacks)]
+    query_every = attacks // queries
+
+    # Old server: sort every player on each request
+    players = {str(i): {"name": f"Player{i}", "gold": 0, "kills": 0} for i in range(player_count)}
+    start = time.perf_counter()
+    for n, (player, gold) in enumerate(events):
+        p = players[str(player)]
+        p["gold"] += gold
+        p["kills"] += 1
+        if n % query_every == 0:
+            board = sorted(
+                [(p["name"], p["gold"], p["kills"]) for p in players.values()],
+                key=lambda x: x[1],
+                reverse=True
+            )
+            board[:10]
+            [entry[0] for entry in board].index(p["name"])
+    report("full sort per request", attacks + queries, time.perf_counter() - start)
+
+    players = {str(i): {"name": f"Player{i}", "gold": 0, "kills": 0} for i in range(player_count)}
+    leaderboard = Leaderboard()
+    for player_id in players:
+        leaderboard.add(player_id)
+    start = time.perf_counter()
+    for n, (player, gold) in enumerate(events):
+        player_id = str(player)
+        p = players[player_id]
+        p["gold"] += gold
+        p["kills"] += 1
+        leaderboard.update(player_id, p["gold"])
+        if n % query_every == 0:
+            [(players[i]["name"], players[i]["gold"], players[i]["kills"]) for i in leaderboard.top(10)]
+            leaderboard.rank(player_id)
+    report("incremental index", attacks + queries, time.perf_counter() - start)
+
+
+class NullConnection:
+    codec = "json"
+
+    def __init__(self):
+        self.sends = 0
+        self.bytes = 0
+
+    def send(self, data, critical=False):
+        self.sends += 1
+        self.bytes += len(data)
+        return True
+
+
+@benchmark("player-delta")
+def bench_player_delta(args):
+    player_count = 5000
+    rounds = max(1, args.count // 1000)
+    changes = player_count // 100
+    print(f"{player_count} players, {changes} attacks between each of {rounds} get_players polls")
+
+    server = GameServer(headless=True)
+    ids = [server.register_player(NullConnection(), None) for _ in range(player_count)]
+    server.tick()
+    rng = random.Random(1)
+
+    totals = {}
+    version = server.player_list_since()["version"]
+    for _ in range(rounds):
+        for _ in range(changes):
+            server.submit_message(rng.choice(ids), {"type": "action", "action": "attack"})
+        server.tick()
+
+        for label, since in (("full snapshot", None), ("delta since last poll", version)):
+            start = time.perf_counter()
+            message = server.player_list_since(since)
+            sizes = {codec: len(encode_payload(message, codec)) for codec in CODECS}
+            elapsed = time.perf_counter() - start
+            total = totals.setdefault(label, {"time": 0, **{codec: 0 for codec in CODECS}})
+            total["time"] += elapsed
+            for codec, size in sizes.items():
+                total[codec] += size
+        version = message["version"]
+
+    for label, total in totals.items():
+        print(f"  {label:<24} build+encode {total['time'] / rounds * 1e3:8.2f}ms  "
+              + "  ".join(f"{codec} {total[codec] // rounds:>8} bytes" for codec in CODECS))
+
+
+@benchmark("burst")
+def bench_burst(args):
+    player_count = 200
+    attackers = 20
+    attacks = max(attackers, args.count // 100)
+    print(f"{player_count} players, {attacks} attacks from {attackers} players in one tick")
+
+    server = GameServer(headless=True, metrics=True)
+    conns = [NullConnection() for _ in range(player_count)]
+    ids = [server.register_player(conn, None) for conn in conns]
+    server.tick()
+    for conn in conns:
+        conn.sends = conn.bytes = 0
+
+    rng = random.Random(1)
+    for _ in range(attacks):
+        server.submit_message(rng.choice(ids[:attackers]), {"type": "action", "action": "attack"})
+    start = time.perf_counter()
+    server.tick()
+    elapsed = time.perf_counter() - start
+
+    counters = server.metrics.counters
+    events = counters["published.achievement"]
+    print(f"  events to everyone      {events * player_count:>9}  ({events} events x {player_count} players)")
+    print(f"  events after coalescing {(events - counters['events_coalesced']) * player_count:>9}")
+    print(f"  events to subscribers   {counters['events_delivered']:>9}  ({len(ISLANDS)} islands)")
+    print(f"  send queue entries      {sum(conn.sends for conn in conns):>9}")
+    print(f"  bytes queued            {sum(conn.bytes for conn in conns):>9}")
+    print(f"  tick time               {elapsed * 1e3:>9.2f}ms")
+
+
+@benchmark("topics")
+def bench_topics(args):
+    members = max(100, args.count // 10)
+    topics = [f"island:{name}" for name in ISLANDS] + [f"party:{n}" for n in range(members // 4)]
+    print(f"{members} players over {len(ISLANDS)} islands and {members // 4} parties")
+
+    index = TopicIndex()
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for member in range(members):
+        index.subscribe(rng.choice(topics[:len(ISLANDS)]), member)
+        index.subscribe(rng.choice(topics[len(ISLANDS):]), member)
+    report("subscribe", members * 2, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for member in range(members):
+        island = next(topic for topic in index.topics_of(member) if topic.startswith("island:"))
+        index.unsubscribe(island, member)
+        index.subscribe(rng.choice(topics[:len(ISLANDS)]), member)
+    report("travel", members, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    audience = 0
+    for member in range(members):
+        audience += len(index.audience(tuple(index.topics_of(member))))
+    report("audience lookup", members, time.perf_counter() - start,
+           f"avg {audience / members:.0f} players")
+
+    start = time.perf_counter()
+    for member in range(members):
+        index.remove(member)
+    report("leave", members, time.perf_counter() - start, f"{len(index)} topics left")
+
+
+@benchmark("journal")
+def bench_journal(args):
+    records = args.count
+    names = [f"Player{i}" for i in range(max(1, records // 100))]
+    per_tick = 100
+    print(f"{records} journaled actions for {len(names)} players, {per_tick} per tick")
+
+    for label, snapshot_every in (("journal only", records + 1), ("snapshot + tail", records * 9 // 10)):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = Journal(directory, fsync="off", snapshot_every=snapshot_every)
+            journal.recover()
+            journal.start()
+            rng = random.Random(1)
+            start = time.perf_counter()
+            for i in range(records):
+                journal.record("attack", rng.choice(names), [i, i // 2, 1, 100, 100])
+                if i % per_tick == per_tick - 1:
+                    journal.commit()
+            journal.close()
+            report(f"{label}: write", records, time.perf_counter() - start)
+
+            recovered = Journal(directory)
+            start = time.perf_counter()
+            replayed = recovered.recover()
+            elapsed = time.perf_counter() - start
+            report(f"{label}: recover", records, elapsed,
+                   f"{replayed} replayed, {len(recovered.state)} players")
+
+
+@benchmark("text")
+def bench_text(args):
+    # Needs no window, pygame draws into an offscreen display
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    from client import GameClient
+    from dashboard import ServerDashboard
+
+    frames = max(60, args.count // 500)
+    print(f"{frames} frames of each screen, mean frame time")
+
+    client = GameClient()
+    client.player_name = "Benchmark"
+    client.current_encounter = SAMPLE_MESSAGES["encounter"]["encounter"]
+    for i in range(15):
+        client.add_message(f"Player{i}: Defeated an enemy! +{i * 7} gold")
+    client.game_state["players"] = SAMPLE_MESSAGES["player_list"]["players"]
+    client.game_state["leaderboard"] = SAMPLE_MESSAGES["leaderboard"]["board"]
+
+    server = GameServer(headless=True)
+    for _ in range(20):
+        server.register_player(NullConnection(), None)
+    server.tick()
+    dashboard = ServerDashboard(server)
+
+    screens = (
+        ("client playing", client, client.draw_playing),
+        ("client leaderboard", client, client.draw_leaderboard),
+        ("server dashboard", dashboard, dashboard.draw),
+    )
+    for label, owner, draw in screens:
+        times = {}
+        for mode, cache in (("render", TextCache(size=0)), ("cached", TextCache())):
+            owner.text = cache
+            draw()
+            start = time.perf_counter()
+            for _ in range(frames):
+                draw()
+            times[mode] = (time.perf_counter() - start) / frames
+        print(f"  {label:<20} font.render {times['render'] * 1e3:7.3f}ms  "
+              f"cached {times['cached'] * 1e3:7.3f}ms  ({times['render'] / times['cached']:.1f}x)")
+
+
+def udp_proxy(proxy, target, loss, rng, done):
+    # Drops datagrams at random, the rest go straight through
+    while not done.is_set():
+        try:
+            data = proxy.recv(2048)
+        except socket.timeout:
+            continue
+        if rng.random() >= loss:
+            proxy.sendto(data, target)
+
+
+def tcp_proxy(listener, downstream, loss, retransmit, rng):
+    # TCP never loses data: a lost segment is a stall until it is
+    # retransmitted, and everything sent after it waits behind it
+    upstream, _ = listener.accept()
+    with upstream:
+        while data := upstream.recv(65536):
+            if rng.random() < loss:
+                time.sleep(retransmit)
+            downstream.sendall(data)
+    downstream.shutdown(socket.SHUT_WR)
+
+
+def send_updates(send, updates, interval):
+    sent = []
+    next_send = time.perf_counter()
+    for seq in range(1, updates + 1):
+        sent.append(time.perf_counter())
+        send(encode_payload({"type": "stats", "seq": seq, "ack": seq, "health": 100, "energy": 100,
+                             "gold": seq, "kills": seq, "level": 1}, "binary"))
+        next_send += interval
+        time.sleep(max(0, next_send - time.perf_counter()))
+    return sent
+
+
+def staleness(sent, applied):
+    """Seconds from sending each update until the receiver held that state or newer"""
+    delays = []
+    fresh = float("inf")
+    for seq in range(len(sent), 0, -1):
+        fresh = min(fresh, applied.get(seq, fresh))
+        if fresh != float("inf"):
+            delays.append(fresh - sent[seq - 1])
+    return sorted(delays)
+
+
+def run_udp_link(updates, interval, loss, rng):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(0.1)
+    proxy = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    proxy.bind(("127.0.0.1", 0))
+    proxy.settimeout(0.1)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(proxy.getsockname())
+
+    done = threading.Event()
+    applied = {}
+
+    def receive():
+        newest = 0
+        while not done.is_set():
+            try:
+                message = decode_message(receiver.recv(2048))
+            except socket.timeout:
+                continue
+            # Latest wins, late or duplicate datagrams are ignored
+            if message["seq"] > newest:
+                newest = message["seq"]
+                applied[newest] = time.perf_counter()
+
+    threads = [
+        threading.Thread(target=udp_proxy, args=(proxy, receiver.getsockname(), loss, rng, done)),
+        threading.Thread(target=receive),
+    ]
+    for thread in threads:
+        thread.start()
+    sent = send_updates(sender.send, updates, interval)
+    time.sleep(0.2)
+    done.set()
+    for thread in threads:
+        thread.join()
+    for sock in (receiver, proxy, sender):
+        sock.close()
+    return sent, applied
+
+
+def run_tcp_link(updates, interval, loss, retransmit, rng):
+    listener = socket.create_server(("127.0.0.1", 0))
+    downstream, receiver = socket.socketpair()
+    applied = {}
+
+    def receive():
+        decoder = FrameDecoder()
+        while decoder.recv_into(receiver):
+            now = time.perf_counter()
+            for payload in decoder.frames():
+                for message in decode_messages(payload):
+                    applied[message["seq"]] = now
+
+    threads = [
+        threading.Thread(target=tcp_proxy, args=(listener, downstream, loss, retransmit, rng)),
+        threading.Thread(target=receive),
+    ]
+    for thread in threads:
+        thread.start()
+    sender = socket.create_connection(listener.getsockname())
+    sender.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sent = send_updates(lambda payload: sender.sendall(encode_frame(payload)), updates, interval)
+    sender.close()
+    for thread in threads:
+        thread.join()
+    for sock in (listener, downstream, receiver):
+        sock.close()
+    return sent, applied
+
+
+@benchmark("udp-loss")
+def bench_udp_loss(args):
+    updates = max(100, args.count // 100)
+    interval = 1 / 100
+    retransmit = 0.2
+    print(f"{updates} stats updates at {1 / interval:.0f}/s through a local proxy, "
+          f"a lost TCP segment stalls the stream for {retransmit * 1e3:.0f}ms")
+
+    for loss in (0.0, 0.01, 0.05):
+        for transport in ("tcp", "udp"):
+            rng = random.Random(1)
+            if transport == "tcp":
+                sent, applied = run_tcp_link(updates, interval, loss, retransmit, rng)
+            else:
+                sent, applied = run_udp_link(updates, interval, loss, rng)
+            delays = staleness(sent, applied)
+            print(f"  {transport} {loss:>4.0%} loss  applied {len(applied):>6}/{updates}  "
+                  f"staleness p50 {delays[len(delays) // 2] * 1e3:7.2f}ms  "
+                  f"p99 {delays[int(len(delays) * 0.99)] * 1e3:7.2f}ms  "
+                  f"max {delays[-1] * 1e3:7.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Island Adventure benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
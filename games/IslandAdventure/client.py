@@ -1,9 +1,13 @@
 import pygame
-import socket
-import json
+import collections
 import threading
+import time
 from enum import Enum
 
+from client_network import ClientNetwork
+from protocol import CODECS
+from textcache import TextCache
+
 # Colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -15,6 +19,24 @@ PURPLE = (200, 0, 200)
 DARK_GREY = (50, 50, 50)
 LIGHT_GREY = (150, 150, 150)
 
+PLAYER_POLL_INTERVAL = 1.0
+
+STAT_KEYS = ("health", "energy", "gold", "kills", "level")
+
+# Predictions the server never acknowledged (e.g. rate limited) are
+# dropped after this many seconds
+PREDICTION_TIMEOUT = 2.0
+
+
+def predict_action(state, action):
+    """Apply the parts of an action we can know before the server answers"""
+    if action == "rest":
+        state["energy"] = min(100, state["energy"] + 40)
+        state["health"] = min(100, state["health"] + 20)
+    elif action == "attack":
+        # The gold is rolled on the server, only the kill is certain
+        state["kills"] += 1
+
 class GameClient:
     def __init__(self, server_host='localhost', server_port=5555):
         pygame.init()
@@ -27,10 +49,17 @@ class GameClient:
         self.font_large = pygame.font.Font(None, 48)
         self.font_medium = pygame.font.Font(None, 32)
         self.font_small = pygame.font.Font(None, 24)
+        self.text = TextCache()
         
         self.server_host = server_host
         self.server_port = server_port
-        self.socket = None
+        self.network = None
+        self.stats_seq = 0
+        # Client-side prediction: actions we applied locally but the server
+        # has not acknowledged yet, replayed on top of its latest stats
+        self.input_seq = 0
+        self.pending_inputs = collections.deque()
+        self.server_stats = None
         self.player_id = None
         self.player_name = "Player"
         
@@ -42,46 +71,94 @@ class GameClient:
             "kills": 0,
             "messages": [],
             "players": [],
-            "leaderboard": []
+            "leaderboard": [],
+            "rank": 0,
+            "island": None,
+            "islands": []
         }
         
+        # Online players by id, kept in sync with player_list deltas
+        self.players_by_id = {}
+        self.players_version = None
+        self.last_player_poll = 0
+        
         self.screen_state = "menu"  # menu, connecting, playing, leaderboard
         self.input_text = ""
         self.current_encounter = None
         
     def connect_to_server(self):
+        network = ClientNetwork(self.server_host, self.server_port)
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.server_host, self.server_port))
-            
-            # Start receiving thread
-            threading.Thread(target=self.receive_messages, daemon=True).start()
-            
-            self.screen_state = "playing"
-            return True
-        except Exception as e:
+            network.connect()
+        except OSError as e:
             print(f"Connection failed: {e}")
+            self.screen_state = "menu"
             return False
+        
+        self.network = network
+        self.screen_state = "playing"
+        return True
     
-    def receive_messages(self):
-        while True:
-            try:
-                data = self.socket.recv(1024).decode()
-                if not data:
-                    break
-                
-                message = json.loads(data)
+    def process_network(self):
+        # Runs on the render thread, so game_state is only touched here
+        if self.network:
+            for message in self.network.drain():
                 self.handle_message(message)
-            except Exception as e:
-                print(f"Receive error: {e}")
-                break
+            
+            pending = self.pending_inputs
+            if pending and time.time() - pending[0][2] > PREDICTION_TIMEOUT:
+                while pending and time.time() - pending[0][2] > PREDICTION_TIMEOUT:
+                    pending.popleft()
+                self.reconcile()
     
     def handle_message(self, message):
         msg_type = message.get("type")
         
         if msg_type == "connection":
             self.player_id = message.get("player_id")
+            self.stats_seq = 0
+            self.input_seq = 0
+            self.pending_inputs.clear()
+            self.server_stats = None
             self.add_message(f"Connected as Player {self.player_id}")
+            self.send_message({"type": "set_name", "name": self.player_name})
+            
+            # Ask for the first codec we both speak, older servers only offer JSON
+            offered = message.get("codecs", ["json"])
+            codec = next((c for c in CODECS if c in offered), "json")
+            if codec != "json":
+                self.send_message({"type": "set_codec", "codec": codec})
+            
+            if "udp_port" in message:
+                self.network.start_udp(message["udp_port"], self.player_id, message["udp_token"])
+        
+        elif msg_type == "name_taken":
+            # The server kept our previous name
+            self.player_name = f"Player{self.player_id}"
+            self.add_message(f"{message.get('name')} is already playing, you are {self.player_name}")
+        
+        elif msg_type == "disconnected":
+            self.add_message("Lost connection to the server")
+        
+        elif msg_type == "subscriptions":
+            # Events only reach us from the island we are on (and our party)
+            self.game_state["islands"] = message.get("islands", [])
+            for topic in message.get("topics", []):
+                kind, _, name = topic.partition(":")
+                if kind == "island" and name != self.game_state["island"]:
+                    self.game_state["island"] = name
+                    self.add_message(f"Arrived at {name}")
+        
+        elif msg_type == "stats":
+            # Arrives over UDP or TCP, possibly out of order: newest wins
+            if message["seq"] <= self.stats_seq:
+                return
+            self.stats_seq = message["seq"]
+            self.server_stats = {key: message[key] for key in STAT_KEYS}
+            pending = self.pending_inputs
+            while pending and pending[0][0] <= message.get("ack", 0):
+                pending.popleft()
+            self.reconcile()
         
         elif msg_type == "encounter":
             player = message.get("player")
@@ -100,31 +177,71 @@ class GameClient:
         
         elif msg_type == "leaderboard":
             self.game_state["leaderboard"] = message.get("board", [])
+            self.game_state["rank"] = message.get("rank", 0)
         
         elif msg_type == "player_list":
-            self.game_state["players"] = message.get("players", [])
+            if message.get("full", True):
+                self.players_by_id = {}
+            for player in message.get("players", []):
+                self.players_by_id[player.get("id", player["name"])] = player
+            for player_id in message.get("removed", []):
+                self.players_by_id.pop(player_id, None)
+            self.players_version = message.get("version")
+            self.game_state["players"] = list(self.players_by_id.values())
     
     def add_message(self, msg):
         self.game_state["messages"].append(msg)
         if len(self.game_state["messages"]) > 15:
             self.game_state["messages"].pop(0)
     
+    def send_message(self, message):
+        # Only queues it, the network writer thread does the sending
+        if self.network:
+            self.network.send(message)
+    
     def send_action(self, action_type, data=None):
-        try:
-            message = {"type": "action", "action": action_type}
-            if data:
-                message.update(data)
-            self.socket.send(json.dumps(message).encode())
-        except Exception as e:
-            print(f"Send error: {e}")
+        self.input_seq += 1
+        message = {"type": "action", "action": action_type, "seq": self.input_seq}
+        if data:
+            message.update(data)
+        self.send_message(message)
+        
+        # Show the result now instead of a round trip later
+        self.pending_inputs.append((self.input_seq, action_type, time.time()))
+        predict_action(self.game_state, action_type)
+    
+    def reconcile(self):
+        # The server's state plus whatever it has not seen yet
+        if self.server_stats is None:
+            return
+        state = dict(self.server_stats)
+        for _, action, _ in self.pending_inputs:
+            predict_action(state, action)
+        self.game_state.update(state)
+    
+    def travel(self):
+        # Sail on to the next island, the server moves our subscription
+        islands = self.game_state["islands"]
+        if not islands:
+            return
+        current = self.game_state["island"]
+        index = islands.index(current) + 1 if current in islands else 0
+        self.send_message({"type": "subscribe", "topic": f"island:{islands[index % len(islands)]}"})
+    
+    def poll_players(self):
+        # Ask only for what changed since the last player_list we applied
+        now = time.time()
+        if now - self.last_player_poll >= PLAYER_POLL_INTERVAL:
+            self.last_player_poll = now
+            self.send_message({"type": "get_players", "since": self.players_version})
     
     def draw_menu(self):
         self.screen.fill(BLACK)
         
-        title = self.font_large.render("Multiplayer Adventure", True, CYAN)
+        title = self.text.render(self.font_large, "Multiplayer Adventure", CYAN)
         self.screen.blit(title, (self.WIDTH // 2 - title.get_width() // 2, 100))
         
-        prompt = self.font_medium.render("Enter your name:", True, WHITE)
+        prompt = self.text.render(self.font_medium, "Enter your name:", WHITE)
         self.screen.blit(prompt, (self.WIDTH // 2 - prompt.get_width() // 2, 250))
         
         # Draw input box
@@ -132,23 +249,23 @@ class GameClient:
         pygame.draw.rect(self.screen, LIGHT_GREY, input_box)
         pygame.draw.rect(self.screen, CYAN, input_box, 2)
         
-        text_surface = self.font_medium.render(self.input_text, True, BLACK)
+        text_surface = self.text.render(self.font_medium, self.input_text, BLACK)
         self.screen.blit(text_surface, (input_box.x + 10, input_box.y + 10))
         
-        instruction = self.font_small.render("Press ENTER to continue", True, YELLOW)
+        instruction = self.text.render(self.font_small, "Press ENTER to continue", YELLOW)
         self.screen.blit(instruction, (self.WIDTH // 2 - instruction.get_width() // 2, 450))
     
     def draw_connecting(self):
         self.screen.fill(BLACK)
         
-        text = self.font_large.render("Connecting to server...", True, CYAN)
+        text = self.text.render(self.font_large, "Connecting to server...", CYAN)
         self.screen.blit(text, (self.WIDTH // 2 - text.get_width() // 2, self.HEIGHT // 2 - 50))
     
     def draw_playing(self):
         self.screen.fill(DARK_GREY)
         
         # Header
-        header = self.font_large.render(f"Welcome, {self.player_name}!", True, CYAN)
+        header = self.text.render(self.font_large, f"Welcome, {self.player_name}!", CYAN)
         self.screen.blit(header, (20, 10))
         
         # Stats panel
@@ -158,43 +275,44 @@ class GameClient:
             f"Energy: {self.game_state['energy']}/100",
             f"Gold: {self.game_state['gold']}",
             f"Level: {self.game_state['level']}",
-            f"Kills: {self.game_state['kills']}"
+            f"Kills: {self.game_state['kills']}",
+            f"Island: {self.game_state['island'] or '?'}"
         ]
         
         for stat in stats:
-            text = self.font_small.render(stat, True, YELLOW)
+            text = self.text.render(self.font_small, stat, YELLOW)
             self.screen.blit(text, (stats_x, stats_y))
             stats_y += 35
         
         # Current encounter
         encounter_y = 70
-        encounter_text = self.font_medium.render("Current Encounter:", True, WHITE)
+        encounter_text = self.text.render(self.font_medium, "Current Encounter:", WHITE)
         self.screen.blit(encounter_text, (self.WIDTH // 2 + 100, encounter_y))
         
         if self.current_encounter:
-            desc = self.font_small.render(self.current_encounter.get("description"), True, GREEN)
+            desc = self.text.render(self.font_small, self.current_encounter.get("description"), GREEN)
             self.screen.blit(desc, (self.WIDTH // 2 + 100, encounter_y + 50))
         else:
-            idle = self.font_small.render("Nothing happening...", True, LIGHT_GREY)
+            idle = self.text.render(self.font_small, "Nothing happening...", LIGHT_GREY)
             self.screen.blit(idle, (self.WIDTH // 2 + 100, encounter_y + 50))
         
         # Active players
         players_y = 300
-        players_text = self.font_medium.render("Online Players:", True, WHITE)
+        players_text = self.text.render(self.font_medium, "Online Players:", WHITE)
         self.screen.blit(players_text, (self.WIDTH // 2 + 100, players_y))
         
         for i, player in enumerate(self.game_state["players"][:3]):
             player_line = f"• {player['name']} (Gold: {player['gold']})"
-            text = self.font_small.render(player_line, True, PURPLE)
+            text = self.text.render(self.font_small, player_line, PURPLE)
             self.screen.blit(text, (self.WIDTH // 2 + 120, players_y + 40 + i * 30))
         
         # Message log
         log_y = 80
-        log_header = self.font_medium.render("Activity Feed:", True, WHITE)
+        log_header = self.text.render(self.font_medium, "Activity Feed:", WHITE)
         self.screen.blit(log_header, (20, log_y - 40))
         
         for message in self.game_state["messages"][-12:]:
-            text = self.font_small.render(message, True, GREEN)
+            text = self.text.render(self.font_small, message, GREEN)
             self.screen.blit(text, (20, log_y))
             log_y += 28
         
@@ -204,33 +322,38 @@ class GameClient:
         self.draw_button("Attack [A]", 220, button_y, 180, 40, RED)
         self.draw_button("Rest [R]", 420, button_y, 180, 40, YELLOW)
         self.draw_button("Leaderboard [L]", 620, button_y, 180, 40, CYAN)
+        self.draw_button("Travel [T]", 820, button_y, 160, 40, GREEN)
     
     def draw_leaderboard(self):
         self.screen.fill(BLACK)
         
-        title = self.font_large.render("Leaderboard", True, CYAN)
+        title = self.text.render(self.font_large, "Leaderboard", CYAN)
         self.screen.blit(title, (self.WIDTH // 2 - title.get_width() // 2, 30))
         
         board_y = 100
-        header = self.font_medium.render("Name".ljust(20) + "Gold".ljust(15) + "Kills", True, YELLOW)
+        header = self.text.render(self.font_medium, "Name".ljust(20) + "Gold".ljust(15) + "Kills", YELLOW)
         self.screen.blit(header, (100, board_y))
         board_y += 40
         
         for rank, (name, gold, kills) in enumerate(self.game_state["leaderboard"][:10], 1):
             entry = f"{rank}. {name}".ljust(20) + str(gold).ljust(15) + str(kills)
             color = GOLD_COLOR if rank == 1 else WHITE
-            text = self.font_small.render(entry, True, color)
+            text = self.text.render(self.font_small, entry, color)
             self.screen.blit(text, (100, board_y))
             board_y += 35
         
-        instruction = self.font_small.render("Press L to return to game", True, GREEN)
+        if self.game_state["rank"]:
+            rank_text = self.text.render(self.font_medium, f"Your rank: #{self.game_state['rank']}", CYAN)
+            self.screen.blit(rank_text, (100, board_y + 15))
+        
+        instruction = self.text.render(self.font_small, "Press L to return to game", GREEN)
         self.screen.blit(instruction, (self.WIDTH // 2 - instruction.get_width() // 2, self.HEIGHT - 50))
     
     def draw_button(self, text, x, y, w, h, color):
         pygame.draw.rect(self.screen, color, (x, y, w, h))
         pygame.draw.rect(self.screen, WHITE, (x, y, w, h), 2)
         
-        text_surface = self.font_small.render(text, True, WHITE)
+        text_surface = self.text.render(self.font_small, text, WHITE)
         self.screen.blit(text_surface, (x + 10, y + 8))
     
     def handle_events(self):
@@ -260,8 +383,10 @@ class GameClient:
                     elif event.key == pygame.K_r:
                         self.send_action("rest")
                     elif event.key == pygame.K_l:
-                        self.socket.send(json.dumps({"type": "get_leaderboard"}).encode())
+                        self.send_message({"type": "get_leaderboard"})
                         self.screen_state = "leaderboard"
+                    elif event.key == pygame.K_t:
+                        self.travel()
             
             elif self.screen_state == "leaderboard":
                 if event.type == pygame.KEYDOWN and event.key == pygame.K_l:
@@ -279,15 +404,18 @@ class GameClient:
             elif self.screen_state == "connecting":
                 self.draw_connecting()
             elif self.screen_state == "playing":
+                self.process_network()
+                self.poll_players()
                 self.draw_playing()
             elif self.screen_state == "leaderboard":
+                self.process_network()
                 self.draw_leaderboard()
             
             pygame.display.flip()
             self.clock.tick(60)
         
-        if self.socket:
-            self.socket.close()
+        if self.network:
+            self.network.close()
         pygame.quit()
 
 GOLD_COLOR = (255, 215, 0)
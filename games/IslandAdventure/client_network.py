@@ -0,0 +1,134 @@
+import collections
+import socket
+import threading
+
+from protocol import FrameDecoder, encode_message, encode_payload, decode_message, decode_messages
+
+# Hellos sent a second apart before giving up on UDP and staying on TCP
+UDP_HELLO_ATTEMPTS = 5
+# The server refreshes stats over UDP every second, so this many seconds
+# without a datagram means the channel broke
+UDP_SILENCE = 3
+
+
+class ClientNetwork:
+    """The client's sockets, kept away from the render thread.
+
+    A reader thread decodes everything the server sends into the inbox and
+    a writer thread empties the outbox, so the game loop only ever appends
+    to and pops from deques. It calls drain() once per frame and send()
+    whenever it likes, and a slow or stalled network never costs a frame.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.udp_socket = None
+        self.inbox = collections.deque()
+        self.outbox = collections.deque()
+        self.ready = threading.Condition()
+        self.closed = False
+
+    def connect(self):
+        # Blocks until connected, call it off the render thread
+        self.sock = socket.create_connection((self.host, self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def send(self, message):
+        with self.ready:
+            self.outbox.append(message)
+            self.ready.notify()
+
+    def drain(self):
+        """Everything received since the last call, oldest first"""
+        messages = []
+        inbox = self.inbox
+        while inbox:
+            messages.append(inbox.popleft())
+        return messages
+
+    def read_loop(self):
+        decoder = FrameDecoder()
+        try:
+            while decoder.recv_into(self.sock):
+                for payload in decoder.frames():
+                    self.inbox.extend(decode_messages(payload))
+        except Exception as e:
+            # Whatever broke, the game still has to hear it got disconnected
+            if not self.closed:
+                print(f"Receive error: {e!r}")
+        if not self.closed:
+            self.inbox.append({"type": "disconnected"})
+
+    def write_loop(self):
+        while True:
+            with self.ready:
+                while not self.outbox and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+                messages = list(self.outbox)
+                self.outbox.clear()
+            # Everything queued since the last write goes out in one sendall
+            data = b"".join(encode_message(message) for message in messages)
+            try:
+                self.sock.sendall(data)
+            except OSError as e:
+                print(f"Send error: {e}")
+                return
+
+    def start_udp(self, port, player_id, token):
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.connect((self.host, port))
+        self.udp_socket.settimeout(1)
+        hello = encode_payload({"type": "udp_hello", "player_id": player_id, "token": token})
+        threading.Thread(target=self.udp_loop, args=(hello,), daemon=True).start()
+
+    def udp_loop(self, hello):
+        # Until the server hears a hello it sends stats over TCP. Once it has,
+        # only a udp_lost over TCP moves them back there, so that is sent
+        # whenever datagrams stop coming, before trying the hellos again.
+        sock = self.udp_socket
+        confirmed = False
+        attempts = 0
+        silent = 0
+        while not self.closed:
+            try:
+                if not confirmed:
+                    if attempts == UDP_HELLO_ATTEMPTS:
+                        print("No UDP from server, staying on TCP")
+                        # A hello may have got through even if nothing came back
+                        self.send({"type": "udp_lost"})
+                        return
+                    attempts += 1
+                    sock.send(hello)
+                payload = sock.recv(2048)
+            except socket.timeout:
+                if confirmed:
+                    silent += 1
+                    if silent == UDP_SILENCE:
+                        print("UDP went quiet, stats back on TCP")
+                        self.send({"type": "udp_lost"})
+                        confirmed = False
+                        attempts = 0
+                continue
+            except OSError:
+                return
+
+            confirmed = True
+            silent = 0
+            try:
+                self.inbox.append(decode_message(payload))
+            except Exception as e:
+                print(f"Bad UDP datagram: {e}")
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        for sock in (self.sock, self.udp_socket):
+            if sock:
+                sock.close()
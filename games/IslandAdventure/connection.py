@@ -0,0 +1,156 @@
+import asyncio
+import collections
+import socket
+import threading
+
+SEND_QUEUE_SIZE = 256
+SLOW_CLIENT_POLICIES = ("drop_oldest", "disconnect")
+
+
+class Connection:
+    """Bounded outbound queue shared by both backends.
+
+    send() never touches the network, it only queues bytes for the
+    connection's writer. When a slow client lets the queue fill up we either
+    drop its oldest non-critical message or disconnect it.
+    """
+
+    def __init__(self, queue_size=SEND_QUEUE_SIZE, policy="drop_oldest"):
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Unknown slow client policy {policy!r}, expected one of {SLOW_CLIENT_POLICIES}")
+        self.codec = "json"
+        self.queue = collections.deque()
+        self.queue_size = queue_size
+        self.policy = policy
+        self.queue_lock = threading.Lock()
+        self.closed = False
+        self.dropped = 0
+        # Each only updated by the connection's reader or writer
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rate_limited = 0
+
+    def send(self, data, critical=False):
+        with self.queue_lock:
+            if self.closed:
+                return False
+            if len(self.queue) >= self.queue_size and not self.make_room():
+                self.closed = True
+                overflowed = True
+            else:
+                self.queue.append((data, critical))
+                overflowed = False
+
+        if overflowed:
+            print("[SLOW CLIENT] Send queue full, disconnecting")
+            self.abort()
+            return False
+        self.wake()
+        return True
+
+    def make_room(self):
+        if self.policy == "disconnect":
+            return False
+        for i, (_, critical) in enumerate(self.queue):
+            if not critical:
+                del self.queue[i]
+                self.dropped += 1
+                return True
+        return False
+
+    def take_all(self):
+        # Drain everything queued so far into a single write
+        with self.queue_lock:
+            data = b"".join(item[0] for item in self.queue)
+            self.queue.clear()
+            return data
+
+    def wake(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+
+class SocketConnection(Connection):
+    """A player connected through a blocking socket (threads backend)"""
+
+    def __init__(self, sock, **kwargs):
+        super().__init__(**kwargs)
+        self.sock = sock
+        self.ready = threading.Condition(self.queue_lock)
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def wake(self):
+        with self.ready:
+            self.ready.notify()
+
+    def write_loop(self):
+        while True:
+            with self.ready:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+            data = self.take_all()
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                return
+            self.bytes_out += len(data)
+
+    def abort(self):
+        # Wakes the reader thread, which unregisters the player and closes
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.wake()
+
+    def close(self):
+        with self.queue_lock:
+            self.closed = True
+        self.wake()
+        self.sock.close()
+
+
+class StreamConnection(Connection):
+    """A player connected through asyncio streams (asyncio backend)"""
+
+    def __init__(self, writer, **kwargs):
+        super().__init__(**kwargs)
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.ready = asyncio.Event()
+        self.writer_task = self.loop.create_task(self.write_loop())
+
+    def wake(self):
+        # send() may also be called from threads other than the event loop
+        if threading.get_ident() == self.loop_thread:
+            self.ready.set()
+        else:
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def write_loop(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                data = self.take_all()
+                if data:
+                    self.writer.write(data)
+                    self.bytes_out += len(data)
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+
+    def abort(self):
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+        self.wake()
+
+    def close(self):
+        with self.queue_lock:
+            self.closed = True
+        self.wake()
+        self.writer.close()
@@ -0,0 +1,91 @@
+import itertools
+import pygame
+
+from textcache import TextCache
+
+# Colors
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+CYAN = (0, 255, 255)
+GREEN = (0, 255, 0)
+RED = (255, 0, 0)
+YELLOW = (255, 255, 0)
+PURPLE = (200, 0, 200)
+DARK_GREY = (50, 50, 50)
+LIGHT_GREY = (150, 150, 150)
+
+class ServerDashboard:
+    """Pygame window showing live server stats, runs on the main thread"""
+    
+    def __init__(self, server):
+        self.server = server
+        
+        pygame.init()
+        self.WIDTH = 1200
+        self.HEIGHT = 700
+        self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
+        pygame.display.set_caption("Game Server Dashboard")
+        self.clock = pygame.time.Clock()
+        self.font_large = pygame.font.Font(None, 48)
+        self.font_medium = pygame.font.Font(None, 32)
+        self.font_small = pygame.font.Font(None, 24)
+        self.text = TextCache()
+    
+    def run(self):
+        while self.server.running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.server.running = False
+            
+            self.draw()
+            pygame.display.flip()
+            self.clock.tick(30)
+        
+        pygame.quit()
+    
+    def draw(self):
+        self.screen.fill(BLACK)
+        
+        # Title
+        title = self.text.render(self.font_large, "Game Server Dashboard", CYAN)
+        self.screen.blit(title, (20, 10))
+        
+        # Server info
+        server_stats = self.server.stats()
+        uptime_text = self.text.render(self.font_small, f"Uptime: {server_stats['uptime']}s | Port: {self.server.port}", YELLOW)
+        self.screen.blit(uptime_text, (20, 70))
+        
+        # Player stats
+        stats_y = 120
+        stats = [
+            f"Connected Players: {server_stats['players']}",
+            f"Total Gold Earned: {server_stats['total_gold']}",
+            f"Total Kills: {server_stats['total_kills']}"
+        ]
+        
+        for stat in stats:
+            text = self.text.render(self.font_medium, stat, GREEN)
+            self.screen.blit(text, (20, stats_y))
+            stats_y += 50
+        
+        # Player list
+        players_y = 350
+        header = self.text.render(self.font_medium, "Online Players:", WHITE)
+        self.screen.blit(header, (20, players_y))
+        players_y += 40
+        
+        # Only copy the rows that fit on screen while holding the game lock
+        rows = (self.HEIGHT - 60 - players_y) // 30
+        with self.server.lock:
+            visible = list(itertools.islice(self.server.players.items(), rows))
+        
+        for player_id, player in visible:
+            info = f"[{player_id}] {player['name']} - Gold: {player['gold']} | Health: {player['health']}/100 | Kills: {player['kills']}"
+            text = self.text.render(self.font_small, info, PURPLE)
+            self.screen.blit(text, (40, players_y))
+            players_y += 30
+        
+        # Legend
+        legend_y = self.HEIGHT - 40
+        legend = self.text.render(self.font_small, "Close this window to stop the server", LIGHT_GREY)
+        self.screen.blit(legend, (20, legend_y))
@@ -0,0 +1,161 @@
+import json
+import os
+import queue
+import threading
+import time
+
+FSYNC_POLICIES = ("batch", "interval", "off")
+FSYNC_INTERVAL = 1.0
+SNAPSHOT_EVERY = 100000
+
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_FORMAT = "journal-{:06d}.log"
+
+
+def segment_number(filename):
+    if filename.startswith("journal-") and filename.endswith(".log"):
+        try:
+            return int(filename[8:-4])
+        except ValueError:
+            pass
+    return None
+
+
+class Journal:
+    """Append-only log of applied actions plus compact snapshots.
+
+    Every record holds the action and the player's resulting state, keyed
+    by name, so replaying is just keeping the last record per player. The
+    simulation thread collects a tick's records and hands them over as one
+    batch, and a writer thread appends them to the current segment. After
+    snapshot_every records the writer dumps the whole state to a snapshot
+    and starts a new segment, so recovery reads the snapshot plus at most
+    one segment's worth of tail.
+    """
+
+    def __init__(self, directory, fsync="interval", snapshot_every=SNAPSHOT_EVERY):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync!r}, expected one of {FSYNC_POLICIES}")
+        self.directory = directory
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        # name -> [gold, kills, level, health, energy, time], everything ever recorded
+        self.state = {}
+        self.pending = []
+        self.since_snapshot = 0
+        self.segment = 0
+        self.batches = queue.Queue()
+        self.thread = None
+        self.records = 0
+        self.snapshots = 0
+
+    def recover(self):
+        """Load the latest snapshot and replay the segments after it, returns the record count"""
+        os.makedirs(self.directory, exist_ok=True)
+        first = 0
+        try:
+            with open(os.path.join(self.directory, SNAPSHOT_FILE)) as f:
+                snapshot = json.load(f)
+            self.state = snapshot["players"]
+            first = snapshot["segment"]
+        except FileNotFoundError:
+            pass
+
+        replayed = 0
+        segments = sorted(n for n in map(segment_number, os.listdir(self.directory)) if n is not None)
+        for number in segments:
+            if number < first:
+                continue
+            with open(os.path.join(self.directory, SEGMENT_FORMAT.format(number)), "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write at the moment of the crash, nothing after it made it
+                        break
+                    self.state[record[1]] = record[2:]
+                    replayed += 1
+        self.segment = max(segments[-1] + 1 if segments else 0, first)
+        self.since_snapshot = replayed
+        return replayed
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, action, name, state):
+        self.state[name] = state
+        self.pending.append(json.dumps([action, name, *state], separators=(",", ":")))
+
+    def commit(self):
+        # Once per tick: one batch, and a snapshot request when it is time
+        if not self.pending:
+            return
+        self.batches.put("\n".join(self.pending) + "\n")
+        self.since_snapshot += len(self.pending)
+        self.records += len(self.pending)
+        self.pending = []
+        if self.since_snapshot >= self.snapshot_every:
+            self.since_snapshot = 0
+            # Values are replaced, never changed in place, so a shallow copy is enough
+            self.batches.put(dict(self.state))
+
+    def close(self):
+        if self.thread:
+            self.commit()
+            self.batches.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        segment = self.open_segment()
+        last_sync = time.monotonic()
+        while True:
+            try:
+                item = self.batches.get(timeout=FSYNC_INTERVAL)
+            except queue.Empty:
+                item = ""
+
+            if item is None:
+                segment.flush()
+                if self.fsync != "off":
+                    os.fsync(segment.fileno())
+                segment.close()
+                return
+
+            if isinstance(item, dict):
+                segment = self.write_snapshot(item, segment)
+                continue
+
+            if item:
+                segment.write(item)
+                segment.flush()
+            if self.fsync == "batch" and item:
+                os.fsync(segment.fileno())
+            elif self.fsync == "interval" and time.monotonic() - last_sync >= FSYNC_INTERVAL:
+                os.fsync(segment.fileno())
+                last_sync = time.monotonic()
+
+    def open_segment(self):
+        return open(os.path.join(self.directory, SEGMENT_FORMAT.format(self.segment)), "a")
+
+    def write_snapshot(self, state, segment):
+        # Everything written so far is in the snapshot, continue in a new segment
+        segment.close()
+        old_segment = self.segment
+        self.segment += 1
+        segment = self.open_segment()
+
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"segment": self.segment, "players": state}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.snapshots += 1
+
+        for filename in os.listdir(self.directory):
+            number = segment_number(filename)
+            if number is not None and number <= old_segment:
+                os.remove(os.path.join(self.directory, filename))
+        return segment
@@ -0,0 +1,48 @@
+import bisect
+import itertools
+
+
+class Leaderboard:
+    """Players kept sorted by gold, updated incrementally as gold changes.
+
+    Entries are (-gold, join order, player_id) tuples in a sorted list, so
+    ties keep join order just like the old sort of the players dict. Finding
+    an entry is a binary search, moving it is a memmove inside the list.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.keys = {}
+        self.join_order = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, player_id, gold=0):
+        key = (-gold, next(self.join_order), player_id)
+        self.keys[player_id] = key
+        bisect.insort(self.entries, key)
+
+    def remove(self, player_id):
+        key = self.keys.pop(player_id, None)
+        if key is not None:
+            del self.entries[bisect.bisect_left(self.entries, key)]
+
+    def update(self, player_id, gold):
+        key = self.keys.get(player_id)
+        if key is None or key[0] == -gold:
+            return
+        del self.entries[bisect.bisect_left(self.entries, key)]
+        key = (-gold, key[1], player_id)
+        self.keys[player_id] = key
+        bisect.insort(self.entries, key)
+
+    def top(self, count):
+        return [key[2] for key in self.entries[:count]]
+
+    def rank(self, player_id):
+        """1-based rank of a player, None if they are not on the board"""
+        key = self.keys.get(player_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.entries, key) + 1
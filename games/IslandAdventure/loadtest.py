@@ -0,0 +1,230 @@
+# Bot swarm load generator for the Island Adventure server
+# Usage: python loadtest.py --bots 500 --rate 2 --duration 30 --spawn-server asyncio
+
+import argparse
+import asyncio
+import collections
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from protocol import CODECS, FrameDecoder, RECV_SIZE, encode_message, decode_messages
+
+ACTIONS = ("encounter", "attack", "rest", "get_leaderboard")
+DEFAULT_MIX = "encounter=1,attack=3,rest=1,get_leaderboard=1"
+
+# Replies a bot can match to its own requests: the broadcast that echoes
+# its own name back, or the leaderboard answer
+REPLY_TYPES = {"encounter": "encounter", "achievement": "attack", "leaderboard": "get_leaderboard"}
+
+
+class Results:
+    def __init__(self):
+        self.sent = collections.Counter()
+        self.received = collections.Counter()
+        self.latencies = collections.defaultdict(list)
+        self.connected = 0
+        self.failed = 0
+
+
+class Bot:
+    def __init__(self, number, args, results):
+        self.name = f"bot{number}"
+        self.args = args
+        self.results = results
+        self.pending = collections.defaultdict(collections.deque)
+
+    async def run(self, deadline):
+        try:
+            reader, writer = await asyncio.open_connection(self.args.host, self.args.port)
+        except OSError:
+            self.results.failed += 1
+            return
+        self.results.connected += 1
+
+        writer.write(encode_message({"type": "set_name", "name": self.name}))
+        if self.args.codec != "json":
+            writer.write(encode_message({"type": "set_codec", "codec": self.args.codec}))
+
+        receiver = asyncio.create_task(self.receive(reader))
+        try:
+            await self.act(writer, deadline)
+        finally:
+            receiver.cancel()
+            writer.close()
+
+    async def act(self, writer, deadline):
+        actions, weights = zip(*self.args.mix.items())
+        rng = random.Random(self.name)
+        # Spread the bots out so they do not all fire on the same tick
+        await asyncio.sleep(rng.random() / self.args.rate)
+        while time.perf_counter() < deadline:
+            action = rng.choices(actions, weights)[0]
+            if action == "get_leaderboard":
+                message = {"type": "get_leaderboard"}
+            else:
+                message = {"type": "action", "action": action}
+            if action in REPLY_TYPES.values():
+                self.pending[action].append(time.perf_counter())
+
+            writer.write(encode_message(message))
+            self.results.sent[action] += 1
+            await writer.drain()
+            await asyncio.sleep(rng.expovariate(self.args.rate))
+
+    async def receive(self, reader):
+        decoder = FrameDecoder()
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                return
+            decoder.feed(data)
+            now = time.perf_counter()
+            for payload in decoder.frames():
+                for message in decode_messages(payload):
+                    self.handle(message, now)
+
+    def handle(self, message, now):
+        msg_type = message.get("type")
+        self.results.received[msg_type] += 1
+
+        action = REPLY_TYPES.get(msg_type)
+        if action and (msg_type == "leaderboard" or message.get("player") == self.name):
+            pending = self.pending[action]
+            if msg_type == "leaderboard":
+                # The server only sends the newest leaderboard per tick, so
+                # one reply answers every request still waiting
+                count = len(pending)
+            else:
+                # A coalesced achievement answers several attacks at once
+                count = message.get("kills", 1) if msg_type == "achievement" else 1
+            for _ in range(count):
+                if pending:
+                    self.results.latencies[action].append(now - pending.popleft())
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def read_server_stats(host, port):
+    with socket.create_connection((host, port), timeout=2) as sock:
+        data = b""
+        while chunk := sock.recv(4096):
+            data += chunk
+    stats = {}
+    for line in data.decode().splitlines():
+        key, _, value = line.partition(" ")
+        stats[key] = value
+    return stats
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        action, _, weight = part.partition("=")
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown action {action!r}, expected one of {ACTIONS}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+async def run_swarm(args):
+    results = Results()
+    deadline = time.perf_counter() + args.duration
+    bots = [Bot(n, args, results) for n in range(args.bots)]
+    tasks = []
+    for bot in bots:
+        tasks.append(asyncio.create_task(bot.run(deadline)))
+        # Ramp up connections instead of hitting the accept backlog at once
+        await asyncio.sleep(args.ramp / max(1, args.bots))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def spawn_server(args):
+    command = [
+        sys.executable, "server.py", "--headless",
+        "--backend", args.spawn_server,
+        "--host", args.host, "--port", str(args.port),
+        "--stats-port", str(args.stats_port),
+        "--send-queue", "100000",
+        # Measure the server, not the per-client limits
+        "--rate-limit", "off",
+    ]
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(50):
+        try:
+            socket.create_connection((args.host, args.stats_port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Island Adventure load generator")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--stats-port", type=int, default=5556,
+                        help="server stats endpoint used to sample CPU and memory")
+    parser.add_argument("--bots", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1.0, help="actions per second per bot")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"relative action weights, default {DEFAULT_MIX}")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds to connect all bots")
+    parser.add_argument("--codec", choices=CODECS, default="json")
+    parser.add_argument("--spawn-server", choices=("threads", "asyncio"),
+                        help="start a headless local server with this backend for the run")
+    args = parser.parse_args()
+
+    server = spawn_server(args) if args.spawn_server else None
+    try:
+        try:
+            before = read_server_stats(args.host, args.stats_port)
+        except OSError:
+            before = None
+
+        start = time.perf_counter()
+        results = asyncio.run(run_swarm(args))
+        elapsed = time.perf_counter() - start
+
+        after = read_server_stats(args.host, args.stats_port) if before else None
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    sent = sum(results.sent.values())
+    received = sum(results.received.values())
+    print(f"Bots: {results.connected} connected, {results.failed} failed, {elapsed:.1f}s")
+    print(f"Sent:     {sent:>9} msgs  {sent / elapsed:>10,.0f} msgs/s")
+    print(f"Received: {received:>9} msgs  {received / elapsed:>10,.0f} msgs/s")
+    print("Round trip latency:")
+    for action in ACTIONS:
+        latencies = results.latencies.get(action)
+        if latencies:
+            print(f"  {action:<16} n={len(latencies):<8} p50 {percentile(latencies, 0.5) * 1e3:8.2f}ms  "
+                  f"p99 {percentile(latencies, 0.99) * 1e3:8.2f}ms")
+
+    if after and "cpu_seconds" in after:
+        cpu = float(after["cpu_seconds"]) - float(before["cpu_seconds"])
+        print(f"Server ({after.get('backend')}): CPU {cpu:.2f}s ({cpu / elapsed:.0%} of one core), "
+              f"max RSS {int(after['max_rss_kb']) / 1024:.1f} MB")
+    elif after:
+        print(f"Server ({after.get('backend')}): no CPU or memory figures on this platform")
+    else:
+        print(f"Server stats unavailable, start the server with --stats-port {args.stats_port}")
+
+
+if __name__ == "__main__":
+    main()
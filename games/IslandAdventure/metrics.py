@@ -0,0 +1,65 @@
+import collections
+
+# Histogram bucket i holds durations below 2**i microseconds
+HISTOGRAM_BUCKETS = 32
+
+
+class Histogram:
+    """Log2 bucketed latency histogram, cheap enough to update every message"""
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        bucket = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the percentile, in microseconds"""
+        target = self.count * fraction
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return 1 << bucket
+        return 0
+
+
+class Metrics:
+    """Counters and histograms for the server.
+
+    Call sites check `enabled` first, so a disabled instance costs one
+    attribute lookup per instrumented spot.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.histograms = collections.defaultdict(Histogram)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+        peak = f"{name}.max"
+        if value > self.gauges.get(peak, 0):
+            self.gauges[peak] = value
+
+    def observe(self, name, seconds):
+        self.histograms[name].observe(seconds)
+
+    def snapshot(self):
+        stats = dict(sorted(self.counters.items()))
+        stats.update(sorted(self.gauges.items()))
+        for name, histogram in sorted(self.histograms.items()):
+            stats[f"{name}.count"] = histogram.count
+            stats[f"{name}.mean_us"] = round(histogram.total / histogram.count * 1e6, 1) if histogram.count else 0
+            stats[f"{name}.p50_us"] = histogram.percentile(0.5)
+            stats[f"{name}.p99_us"] = histogram.percentile(0.99)
+        return stats
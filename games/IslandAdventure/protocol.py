@@ -0,0 +1,268 @@
+import json
+import struct
+
+# Every message on the wire is a 4 byte big-endian length followed by the payload
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 1 << 20
+RECV_SIZE = 65536
+
+# JSON payloads always start with "{", binary payloads start with a message type ID
+CODECS = ("binary", "json")
+MSG_BATCH = 0
+MSG_PLAYER_LIST = 1
+MSG_LEADERBOARD = 2
+MSG_ENCOUNTER = 3
+MSG_STATS = 4
+
+ENCOUNTER_KINDS = ("merchant", "combat", "treasure", "npc", "mystery")
+
+TYPE_ID = struct.Struct("!B")
+COUNT = struct.Struct("!H")
+RANK = struct.Struct("!I")
+STR8 = struct.Struct("!B")
+STR16 = struct.Struct("!H")
+PLAYER_STATS = struct.Struct("!IhH")  # gold, health, level
+PLAYER_LIST_HEADER = struct.Struct("!I?")  # version, full snapshot
+LEADERBOARD_STATS = struct.Struct("!II")  # gold, kills
+ENCOUNTER_KIND = struct.Struct("!B")
+PLAYER_STATE = struct.Struct("!IIhhIIH")  # seq, ack, health, energy, gold, kills, level
+
+
+def pack_str(parts, text, prefix=STR8):
+    data = text.encode()
+    parts.append(prefix.pack(len(data)))
+    parts.append(data)
+
+
+def unpack_str(payload, offset, prefix=STR8):
+    (length,) = prefix.unpack_from(payload, offset)
+    offset += prefix.size
+    return payload[offset:offset + length].decode(), offset + length
+
+
+def encode_player_list(message):
+    players = message["players"]
+    removed = message.get("removed", [])
+    parts = [
+        TYPE_ID.pack(MSG_PLAYER_LIST),
+        PLAYER_LIST_HEADER.pack(message.get("version", 0), message.get("full", True)),
+        COUNT.pack(len(players))
+    ]
+    for player in players:
+        pack_str(parts, player.get("id", ""))
+        pack_str(parts, player["name"])
+        parts.append(PLAYER_STATS.pack(player["gold"], player["health"], player["level"]))
+    parts.append(COUNT.pack(len(removed)))
+    for player_id in removed:
+        pack_str(parts, player_id)
+    return b"".join(parts)
+
+
+def decode_player_list(payload, offset):
+    version, full = PLAYER_LIST_HEADER.unpack_from(payload, offset)
+    offset += PLAYER_LIST_HEADER.size
+    (count,) = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    players = []
+    for _ in range(count):
+        player_id, offset = unpack_str(payload, offset)
+        name, offset = unpack_str(payload, offset)
+        gold, health, level = PLAYER_STATS.unpack_from(payload, offset)
+        offset += PLAYER_STATS.size
+        players.append({"id": player_id, "name": name, "gold": gold, "health": health, "level": level})
+    (count,) = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    removed = []
+    for _ in range(count):
+        player_id, offset = unpack_str(payload, offset)
+        removed.append(player_id)
+    return {"type": "player_list", "version": version, "full": bool(full), "players": players, "removed": removed}
+
+
+def encode_leaderboard(message):
+    board = message["board"]
+    parts = [TYPE_ID.pack(MSG_LEADERBOARD), RANK.pack(message.get("rank", 0)), COUNT.pack(len(board))]
+    for name, gold, kills in board:
+        pack_str(parts, name)
+        parts.append(LEADERBOARD_STATS.pack(gold, kills))
+    return b"".join(parts)
+
+
+def decode_leaderboard(payload, offset):
+    (rank,) = RANK.unpack_from(payload, offset)
+    offset += RANK.size
+    (count,) = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    board = []
+    for _ in range(count):
+        name, offset = unpack_str(payload, offset)
+        gold, kills = LEADERBOARD_STATS.unpack_from(payload, offset)
+        offset += LEADERBOARD_STATS.size
+        board.append([name, gold, kills])
+    return {"type": "leaderboard", "board": board, "rank": rank}
+
+
+def encode_encounter(message):
+    encounter = message["encounter"]
+    parts = [TYPE_ID.pack(MSG_ENCOUNTER)]
+    pack_str(parts, message["player"])
+    parts.append(ENCOUNTER_KIND.pack(ENCOUNTER_KINDS.index(encounter["type"])))
+    pack_str(parts, encounter["description"], STR16)
+    return b"".join(parts)
+
+
+def decode_encounter(payload, offset):
+    player, offset = unpack_str(payload, offset)
+    (kind,) = ENCOUNTER_KIND.unpack_from(payload, offset)
+    description, offset = unpack_str(payload, offset + ENCOUNTER_KIND.size, STR16)
+    return {
+        "type": "encounter",
+        "player": player,
+        "encounter": {"type": ENCOUNTER_KINDS[kind], "description": description}
+    }
+
+
+def encode_stats(message):
+    return TYPE_ID.pack(MSG_STATS) + PLAYER_STATE.pack(
+        message["seq"], message["ack"], message["health"], message["energy"],
+        message["gold"], message["kills"], message["level"]
+    )
+
+
+def decode_stats(payload, offset):
+    seq, ack, health, energy, gold, kills, level = PLAYER_STATE.unpack_from(payload, offset)
+    return {
+        "type": "stats", "seq": seq, "ack": ack, "health": health, "energy": energy,
+        "gold": gold, "kills": kills, "level": level
+    }
+
+
+def decode_batch(payload, offset):
+    messages = []
+    while offset < len(payload):
+        (length,) = HEADER.unpack_from(payload, offset)
+        offset += HEADER.size
+        messages.append(decode_message(payload[offset:offset + length]))
+        offset += length
+    return {"type": "batch", "messages": messages}
+
+
+BINARY_ENCODERS = {
+    "player_list": encode_player_list,
+    "leaderboard": encode_leaderboard,
+    "encounter": encode_encounter,
+    "stats": encode_stats,
+}
+
+BINARY_DECODERS = {
+    MSG_BATCH: decode_batch,
+    MSG_PLAYER_LIST: decode_player_list,
+    MSG_LEADERBOARD: decode_leaderboard,
+    MSG_ENCOUNTER: decode_encounter,
+    MSG_STATS: decode_stats,
+}
+
+
+def encode_payload(message, codec="json"):
+    if codec == "binary":
+        encoder = BINARY_ENCODERS.get(message.get("type"))
+        if encoder:
+            try:
+                return encoder(message)
+            except (AttributeError, KeyError, ValueError, TypeError, struct.error):
+                # Values that do not fit the fixed layout go out as JSON
+                pass
+    return json.dumps(message).encode()
+
+
+def encode_frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message, codec="json"):
+    return encode_frame(encode_payload(message, codec))
+
+
+def encode_batch(frames):
+    """Already encoded frames back to back, for a single write"""
+    # No MSG_BATCH envelope: a JSON client could not read it, and the
+    # frames split apart again in FrameDecoder anyway
+    return b"".join(frames)
+
+
+def decode_messages(payload):
+    """Decode a frame payload into a list of messages, unpacking batches"""
+    message = decode_message(payload)
+    if message.get("type") == "batch":
+        return message["messages"]
+    return [message]
+
+
+def decode_message(payload):
+    if payload[:1] == b"{":
+        return json.loads(payload)
+    (type_id,) = TYPE_ID.unpack_from(payload)
+    decoder = BINARY_DECODERS.get(type_id)
+    if decoder is None:
+        raise ValueError(f"Unknown binary message type {type_id}")
+    return decoder(payload, TYPE_ID.size)
+
+
+class FrameDecoder:
+    """Streaming decoder that splits received bytes back into frames.
+
+    Bytes are received straight into one reusable buffer, so a read can hold
+    any number of whole frames plus the start of the next one.
+    """
+
+    def __init__(self, size=RECV_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.max_frame_size = max_frame_size
+
+    def reserve(self, size):
+        if len(self.buffer) - self.end >= size:
+            return
+
+        # Slide pending bytes to the front before growing the buffer
+        pending = self.end - self.start
+        if self.start:
+            self.buffer[:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+
+        if len(self.buffer) - self.end < size:
+            self.view.release()
+            self.buffer.extend(bytes(max(len(self.buffer), size)))
+            self.view = memoryview(self.buffer)
+
+    def recv_into(self, sock, size=RECV_SIZE):
+        """Receive from a blocking socket, returns 0 when the peer closed"""
+        self.reserve(size)
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        self.reserve(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        while self.end - self.start >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, self.start)
+            if length > self.max_frame_size:
+                raise ValueError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+
+            body = self.start + HEADER.size
+            if self.end - body < length:
+                # Make sure a large frame fits once the rest of it arrives
+                self.reserve(HEADER.size + length - (self.end - self.start))
+                return
+
+            self.start = body + length
+            yield bytes(self.view[body:self.start])
+
+        if self.start == self.end:
+            self.start = self.end = 0
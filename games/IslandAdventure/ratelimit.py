@@ -0,0 +1,81 @@
+import argparse
+import time
+
+# kind=rate/burst, "message" covers every message from the connection and
+# the others only the action (or message type) of that name
+DEFAULT_RATE_LIMITS = "message=40/80,attack=8/16,encounter=4/8,rest=4/8"
+RATE_LIMIT_POLICIES = ("drop", "defer")
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`, one token per message"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """The buckets of one connection, only used by that connection's reader"""
+
+    def __init__(self, limits, policy="drop"):
+        if policy not in RATE_LIMIT_POLICIES:
+            raise ValueError(f"Unknown rate limit policy {policy!r}, expected one of {RATE_LIMIT_POLICIES}")
+        self.policy = policy
+        self.buckets = {kind: TokenBucket(rate, burst) for kind, (rate, burst) in limits.items()}
+
+    def admit(self, kind):
+        """Seconds to hold a message of this kind before passing it on, None to drop it.
+
+        A dropped message is not charged, so a rejected attack does not eat
+        into the overall budget. A deferred one is charged right away and may
+        leave the buckets in debt, so a client that keeps sending waits
+        longer and longer while TCP pushes back on it.
+        """
+        now = time.monotonic()
+        buckets = [self.buckets[name] for name in ("message", kind) if name in self.buckets]
+        wait = 0.0
+        for bucket in buckets:
+            bucket.refill(now)
+            wait = max(wait, bucket.wait_time())
+        if wait and self.policy == "drop":
+            return None
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return wait
+
+
+def message_kind(message):
+    if message.get("type") == "action":
+        return message.get("action")
+    return message.get("type")
+
+
+def parse_rate_limits(text):
+    """Parse "kind=rate/burst,..." into {kind: (rate, burst)}, "off" disables limiting"""
+    if text in ("", "off"):
+        return {}
+    limits = {}
+    for part in text.split(","):
+        kind, _, spec = part.partition("=")
+        rate, _, burst = spec.partition("/")
+        try:
+            rate = float(rate)
+            burst = float(burst or rate)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Bad rate limit {part!r}, expected kind=rate/burst")
+        if rate <= 0 or burst < 1:
+            raise argparse.ArgumentTypeError(f"Bad rate limit {part!r}, rate must be positive and burst at least 1")
+        limits[kind.strip()] = (rate, burst)
+    return limits
@@ -1,58 +1,259 @@
 import socket
 import threading
-import json
+import asyncio
+import argparse
+import itertools
+import collections
 import random
 import time
-import pygame
+import secrets
+import signal
+import struct
+
+try:
+    import resource
+except ImportError:
+    # Windows: no CPU and memory figures in the stats
+    resource = None
+
+from journal import FSYNC_POLICIES, SNAPSHOT_EVERY, Journal
+from leaderboard import Leaderboard
+from metrics import Metrics
+from ratelimit import DEFAULT_RATE_LIMITS, RATE_LIMIT_POLICIES, RateLimiter, message_kind, parse_rate_limits
+from storage import FLUSH_INTERVAL, PlayerStore
+from topics import TopicIndex
+from connection import SEND_QUEUE_SIZE, SLOW_CLIENT_POLICIES, SocketConnection, StreamConnection
+from protocol import (CODECS, FrameDecoder, RECV_SIZE, encode_batch, encode_message, encode_payload,
+                      decode_message, decode_messages)
+
+BACKENDS = ("threads", "asyncio")
+TICK_RATE = 20
+
+# Per-player stats updates per second, everyone on UDP gets a fresh copy
+# every second even if nothing changed in case the last one was lost
+STATS_RATE = 10
+
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+
+# Removed players remembered for player_list deltas, older clients resync
+PLAYER_TOMBSTONES = 1024
+
+# Message types and actions the server handles; metrics for anything else
+# a client sends are counted under "unknown" so clients can't mint new keys
+MESSAGE_KINDS = {"set_name", "set_codec", "get_leaderboard", "get_players", "subscribe", "unsubscribe",
+                 "udp_lost", "encounter", "attack", "rest", "take_damage"}
+
+# Never dropped when a slow client's send queue is full
+CRITICAL_MESSAGES = {"connection", "death", "leaderboard", "player_list"}
+
+# Replies where only the newest one sent to a player in a tick matters
+LATEST_ONLY_MESSAGES = {"leaderboard"}
+
+# Events only go to the players following a topic they were published to:
+# everyone is on exactly one island, in at most one party, and can opt in
+# to the global feed of every event
+ISLANDS = ("Coral Cove", "Skull Rock", "Mist Harbor", "Palm Key")
+GLOBAL_TOPIC = "global"
+MAX_PARTY_NAME = 32
+
+
+def achievement_text(kills, gold):
+    if kills == 1:
+        return f"Defeated an enemy! +{gold} gold"
+    return f"Defeated {kills} enemies! +{gold} gold"
+
+
+def coalesce_events(events):
+    """Merge a tick's achievements per player into one running total.
+    
+    Takes (topics, message, player_id) and returns (topics, message). Merged
+    by player ID and topics, display names are chosen by clients and need
+    not be unique.
+    """
+    merged = []
+    achievements = {}
+    for topics, message, player_id in events:
+        if message["type"] != "achievement" or player_id is None:
+            merged.append((topics, message))
+            continue
+        
+        key = (player_id, topics)
+        total = achievements.get(key)
+        if total is None:
+            total = achievements[key] = dict(message)
+            merged.append((topics, total))
+        else:
+            total["gold"] += message["gold"]
+            total["kills"] += message["kills"]
+            total["message"] = achievement_text(total["kills"], total["gold"])
+    return merged
+
+
+def latest_replies(replies):
+    """Drop replies superseded by a newer one of the same type"""
+    if len(replies) < 2:
+        return replies
+    latest = {}
+    for i, message in enumerate(replies):
+        if message["type"] in LATEST_ONLY_MESSAGES:
+            latest[message["type"]] = i
+    return [
+        message for i, message in enumerate(replies)
+        if latest.get(message["type"], i) == i
+    ]
 
-# Colors
-WHITE = (255, 255, 255)
-BLACK = (0, 0, 0)
-CYAN = (0, 255, 255)
-GREEN = (0, 255, 0)
-RED = (255, 0, 0)
-YELLOW = (255, 255, 0)
-PURPLE = (200, 0, 200)
-DARK_GREY = (50, 50, 50)
-LIGHT_GREY = (150, 150, 150)
 
 class GameServer:
-    def __init__(self, host='localhost', port=5555):
+    def __init__(self, host='localhost', port=5555, backend="threads",
+                 send_queue_size=SEND_QUEUE_SIZE, slow_client_policy="drop_oldest",
+                 headless=False, stats_port=None, tick_rate=TICK_RATE,
+                 metrics=False, metrics_interval=None, db_path=None,
+                 flush_interval=FLUSH_INTERVAL, rate_limits=None, rate_limit_policy="drop",
+                 udp_port=None, journal_dir=None, journal_fsync="interval",
+                 snapshot_every=SNAPSHOT_EVERY, shard=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        if rate_limit_policy not in RATE_LIMIT_POLICIES:
+            raise ValueError(f"Unknown rate limit policy {rate_limit_policy!r}, expected one of {RATE_LIMIT_POLICIES}")
         self.host = host
         self.port = port
+        self.backend = backend
+        self.connection_options = {"queue_size": send_queue_size, "policy": slow_client_policy}
+        # Checked by each connection's reader, so a flooding client is held
+        # back before its messages reach the inbox or cost a broadcast
+        self.rate_limits = rate_limits or {}
+        self.rate_limit_policy = rate_limit_policy
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.players = {}
+        self.player_ids = itertools.count(1)
+        # Names claimed with set_name by players connected here, so two live
+        # sessions never load and save the same profile. Sharded, the hub
+        # grants the claims across shards and this holds the ones granted here
+        self.names = {}
+        
+        # Sharded: every worker listens on the same port and hands out a
+        # disjoint series of player IDs
+        self.shard = shard
+        self.remote_events = []
+        self.global_leaderboard = None
+        if shard:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.player_ids = itertools.count(shard.index + 1, shard.count)
+        self.leaderboard = Leaderboard()
+        
+        # Profiles are saved by name, a player's stored gold is added back
+        # once the storage thread has looked up the name they picked
+        self.store = PlayerStore(db_path, flush_interval) if db_path else None
+        # Every applied action is journaled with its result, so after a
+        # crash a returning name gets the state it had. The store only
+        # catches up every flush interval but is shared by all shards, so
+        # whichever of the two was updated last wins
+        self.journal = Journal(journal_dir, journal_fsync, snapshot_every) if journal_dir else None
+        
+        # player_list versioning: every change bumps players_version and moves
+        # the player to the end of player_versions, so a delta only walks the
+        # players changed since the client's version
+        self.players_version = 0
+        self.player_versions = collections.OrderedDict()
+        self.removed_players = collections.OrderedDict()
+        self.tombstone_horizon = 0
         self.game_state = {
             "current_encounter": None,
             "leaderboard": []
         }
-        self.lock = threading.Lock()
-        
-        # Pygame setup
-        pygame.init()
-        self.WIDTH = 1200
-        self.HEIGHT = 700
-        self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
-        pygame.display.set_caption("Game Server Dashboard")
-        self.clock = pygame.time.Clock()
-        self.font_large = pygame.font.Font(None, 48)
-        self.font_medium = pygame.font.Font(None, 32)
-        self.font_small = pygame.font.Font(None, 24)
         
+        # Network handlers only append (kind, player_id, data) events to the
+        # inbox, deque appends and pops are atomic so they never take a lock.
+        # The simulation thread applies them in batches every tick and queues
+        # everything it sends in the outbox, flushed once per client per tick.
+        self.tick_rate = tick_rate
+        self.inbox = collections.deque()
+        self.outbox = {}
+        self.tick_events = []
+        self.topics = TopicIndex()
+        self.ticks = 0
+        
+        # Optional UDP side channel for the stats updates only: a lost
+        # datagram is superseded by the next one instead of holding up the
+        # TCP stream behind it. Players stay on TCP until their client
+        # proves its address with the token from the connection message.
+        self.udp_port = udp_port
+        self.udp = None
+        self.stats_dirty = set()
+        self.stats_every = max(1, round(tick_rate / STATS_RATE))
+        
+        # Held by the simulation thread while it applies a tick, readers like
+        # the dashboard and stats take it to get a consistent view
+        self.lock = threading.RLock()
+        
+        self.headless = headless
+        self.stats_port = stats_port
+        self.metrics = Metrics(enabled=metrics or bool(metrics_interval))
+        self.metrics_interval = metrics_interval
         self.running = True
         self.start_time = time.time()
         
     def start(self):
+        if self.journal:
+            start = time.perf_counter()
+            replayed = self.journal.recover()
+            print(f"[JOURNAL] Recovered {len(self.journal.state)} players from the snapshot and "
+                  f"{replayed} journal records in {time.perf_counter() - start:.3f}s")
+            self.journal.start()
+        if self.store:
+            self.store.start()
         self.server.bind((self.host, self.port))
-        self.server.listen()
-        print(f"[SERVER] Started on {self.host}:{self.port}")
+        self.server.listen(1024)
+        if self.udp_port:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.bind((self.host, self.udp_port))
+            self.udp.settimeout(1)
+            self.udp_port = self.udp.getsockname()[1]
+            threading.Thread(target=self.receive_udp, daemon=True).start()
+        if self.shard:
+            print(f"[SHARD {self.shard.index}] Started on {self.host}:{self.port} ({self.backend} backend)")
+            self.shard.attach(self)
+        else:
+            print(f"[SERVER] Started on {self.host}:{self.port} ({self.backend} backend)")
+        if self.udp:
+            print(f"[SERVER] Stats updates over UDP on {self.host}:{self.udp_port}")
         print("[SERVER] Waiting for connections...")
         
+        threading.Thread(target=self.run_simulation, daemon=True).start()
+        
         # Run server socket listening in background
-        threading.Thread(target=self.accept_connections, daemon=True).start()
+        if self.backend == "asyncio":
+            threading.Thread(target=self.run_asyncio, daemon=True).start()
+        else:
+            threading.Thread(target=self.accept_connections, daemon=True).start()
+        
+        if self.stats_port:
+            threading.Thread(target=self.serve_stats, daemon=True).start()
+        if self.metrics_interval:
+            threading.Thread(target=self.log_metrics, daemon=True).start()
         
-        # Run pygame dashboard in main thread
-        self.run_dashboard()
+        if self.headless:
+            # Nothing to draw, just keep the main thread parked until Ctrl+C
+            try:
+                while self.running:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                self.running = False
+        else:
+            # Only import pygame when we actually show the dashboard
+            from dashboard import ServerDashboard
+            ServerDashboard(self).run()
+        
+        if self.store:
+            with self.lock:
+                for player in self.players.values():
+                    self.save_profile(player)
+            self.store.close()
+        if self.journal:
+            with self.lock:
+                self.journal.close()
     
     def accept_connections(self):
         try:
@@ -69,126 +270,557 @@ class GameServer:
         finally:
             self.server.close()
     
-    def handle_player(self, client_socket, addr):
-        player_id = str(len(self.players) + 1)
+    def register_player(self, conn, addr):
+        # Network side: hand out an ID now, the player joins on the next tick
+        player_id = str(next(self.player_ids))
+        self.inbox.append(("join", player_id, (conn, addr)))
+        return player_id
+    
+    def unregister_player(self, player_id):
+        self.inbox.append(("leave", player_id, None))
+    
+    def submit_message(self, player_id, message):
+        self.inbox.append(("message", player_id, message))
+    
+    def make_limiter(self):
+        if self.rate_limits:
+            return RateLimiter(self.rate_limits, self.rate_limit_policy)
+        return None
+    
+    def admit(self, limiter, conn, message):
+        # Seconds the reader should wait before submitting, None to drop
+        if limiter is None:
+            return 0
+        delay = limiter.admit(message_kind(message))
+        if delay != 0:
+            conn.rate_limited += 1
+        return delay
+    
+    def run_simulation(self):
+        interval = 1 / self.tick_rate
+        next_tick = time.perf_counter()
+        while self.running:
+            try:
+                self.tick()
+            except Exception as e:
+                # One bad tick must not stop the game for everyone. Whatever
+                # it left queued for sending is dropped so it can't fail again.
+                print(f"[ERROR] Tick {self.ticks}: {e!r}")
+                with self.lock:
+                    self.tick_events = []
+                    self.outbox = {}
+                    if self.metrics.enabled:
+                        self.metrics.count("tick_errors")
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Overloaded, start the next tick now instead of bursting to catch up
+                next_tick = time.perf_counter()
+    
+    def tick(self):
+        # Only drain what was queued before the tick started, late arrivals wait
+        inbox = self.inbox
+        pending = len(inbox)
+        metrics = self.metrics
+        timed = metrics.enabled
+        if timed:
+            wait_start = time.perf_counter()
         
         with self.lock:
-            self.players[player_id] = {
-                "addr": addr,
-                "socket": client_socket,
-                "name": f"Player{player_id}",
-                "health": 100,
-                "energy": 100,
-                "gold": 0,
-                "level": 1,
-                "kills": 0,
-                "connected": True
-            }
+            if timed:
+                tick_start = time.perf_counter()
+                metrics.observe("lock_wait", tick_start - wait_start)
+                metrics.gauge("inbox_depth", pending)
+            
+            for _ in range(pending):
+                kind, player_id, data = inbox.popleft()
+                try:
+                    if kind == "message":
+                        if timed:
+                            start = time.perf_counter()
+                            self.process_message(player_id, data)
+                            label = message_kind(data)
+                            if label not in MESSAGE_KINDS:
+                                label = "unknown"
+                            metrics.count(f"messages.{label}")
+                            metrics.observe(f"handle.{label}", time.perf_counter() - start)
+                        else:
+                            self.process_message(player_id, data)
+                    elif kind == "join":
+                        self.add_player(player_id, *data)
+                    elif kind == "leave":
+                        self.remove_player(player_id)
+                    elif kind == "profile":
+                        self.apply_profile(player_id, *data)
+                    elif kind == "udp_hello":
+                        self.set_udp_address(player_id, *data)
+                    elif kind == "remote_events":
+                        self.remote_events.extend(data)
+                    elif kind == "global_leaderboard":
+                        self.global_leaderboard = data
+                    elif kind == "name_claim":
+                        self.name_claimed(*data)
+                except Exception as e:
+                    print(f"[ERROR] Player {player_id}: {e}")
+            self.ticks += 1
+            if self.shard and self.ticks % self.tick_rate == 0:
+                self.shard.publish_leaderboard(self.top_players(MAX_LEADERBOARD_SIZE))
+            
+            if self.ticks % self.stats_every == 0:
+                self.send_stats(refresh=self.ticks % self.tick_rate == 0)
+            if self.journal:
+                self.journal.commit()
+            
+            # Only queues bytes for the connection writers, no network I/O
+            self.flush_outbox()
+            if timed:
+                metrics.observe("tick", time.perf_counter() - tick_start)
+    
+    def add_player(self, player_id, conn, addr):
+        self.players[player_id] = {
+            "addr": addr,
+            "conn": conn,
+            "name": f"Player{player_id}",
+            "health": 100,
+            "energy": 100,
+            "gold": 0,
+            "level": 1,
+            "kills": 0,
+            "profile": None,
+            "stats_seq": 0,
+            "input_seq": 0,
+            "udp_token": secrets.token_hex(8) if self.udp else None,
+            "udp_addr": None,
+            "island": None,
+            "party": None,
+            "connected": True
+        }
+        self.leaderboard.add(player_id)
+        self.mark_player_changed(player_id)
         
-        try:
-            # Send player ID to client
-            self.send_to_player(client_socket, {
-                "type": "connection",
-                "player_id": player_id
-            })
+        # Send player ID to client
+        message = {
+            "type": "connection",
+            "player_id": player_id,
+            "codecs": list(CODECS)
+        }
+        if self.udp:
+            message["udp_port"] = self.udp_port
+            message["udp_token"] = self.players[player_id]["udp_token"]
+        self.send_to_player(conn, message)
+        
+        # Spread newcomers over the islands
+        island = min(ISLANDS, key=lambda name: self.topics.count(f"island:{name}"))
+        self.subscribe(player_id, f"island:{island}")
+    
+    def remove_player(self, player_id):
+        if player_id in self.players:
+            conn = self.players[player_id]["conn"]
+            if self.metrics.enabled:
+                # Keep the traffic of closed connections in the totals
+                self.metrics.count("bytes_in", conn.bytes_in)
+                self.metrics.count("bytes_out", conn.bytes_out)
+                self.metrics.count("dropped_messages", conn.dropped)
+                self.metrics.count("rate_limited", conn.rate_limited)
+            self.save_profile(self.players[player_id])
+            if self.names.get(self.players[player_id]["name"]) == player_id:
+                del self.names[self.players[player_id]["name"]]
+            if self.shard:
+                self.shard.release_name(player_id)
+            self.players[player_id]["connected"] = False
+            del self.players[player_id]
+            self.leaderboard.remove(player_id)
+            self.topics.remove(player_id)
             
+            del self.player_versions[player_id]
+            self.players_version += 1
+            self.removed_players[player_id] = self.players_version
+            if len(self.removed_players) > PLAYER_TOMBSTONES:
+                _, self.tombstone_horizon = self.removed_players.popitem(last=False)
+        print(f"[DISCONNECT] Player {player_id} disconnected")
+    
+    def handle_player(self, client_socket, addr):
+        conn = SocketConnection(client_socket, **self.connection_options)
+        player_id = self.register_player(conn, addr)
+        decoder = FrameDecoder()
+        limiter = self.make_limiter()
+        
+        try:
+            while received := decoder.recv_into(client_socket):
+                conn.bytes_in += received
+                for payload in decoder.frames():
+                    for message in decode_messages(payload):
+                        delay = self.admit(limiter, conn, message)
+                        if delay is None:
+                            continue
+                        if delay:
+                            time.sleep(delay)
+                        self.submit_message(player_id, message)
+        
+        except Exception as e:
+            print(f"[ERROR] Player {player_id}: {e}")
+        
+        finally:
+            self.unregister_player(player_id)
+            conn.close()
+    
+    def receive_udp(self):
+        # Clients only ever send a hello to tie their address to a player
+        while self.running:
+            try:
+                payload, addr = self.udp.recvfrom(2048)
+                message = decode_message(payload)
+            except (OSError, ValueError, struct.error):
+                continue
+            if isinstance(message, dict) and message.get("type") == "udp_hello":
+                self.inbox.append(("udp_hello", str(message.get("player_id")), (message.get("token"), addr)))
+    
+    def set_udp_address(self, player_id, token, addr):
+        player = self.players.get(player_id)
+        if player and token == player["udp_token"]:
+            player["udp_addr"] = addr
+            # Answer right away so the client knows the channel works
+            self.stats_dirty.add(player_id)
+    
+    def run_asyncio(self):
+        asyncio.run(self.serve_async())
+    
+    async def serve_async(self):
+        # One task per client on a single event loop thread, so idle
+        # connections cost a socket and a coroutine instead of an OS thread
+        server = await asyncio.start_server(self.handle_player_async, sock=self.server)
+        async with server:
+            while self.running:
+                await asyncio.sleep(1)
+    
+    async def handle_player_async(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        print(f"[CONNECTION] New player from {addr}")
+        conn = StreamConnection(writer, **self.connection_options)
+        player_id = self.register_player(conn, addr)
+        decoder = FrameDecoder()
+        limiter = self.make_limiter()
+        
+        try:
             while True:
-                data = client_socket.recv(1024).decode()
+                data = await reader.read(RECV_SIZE)
                 if not data:
                     break
                 
-                message = json.loads(data)
-                self.process_message(player_id, message)
+                conn.bytes_in += len(data)
+                decoder.feed(data)
+                for payload in decoder.frames():
+                    for message in decode_messages(payload):
+                        delay = self.admit(limiter, conn, message)
+                        if delay is None:
+                            continue
+                        if delay:
+                            await asyncio.sleep(delay)
+                        self.submit_message(player_id, message)
+                
+                # read() does not yield while data is buffered, give the
+                # connection writers a turn before handling the next batch
+                await asyncio.sleep(0)
         
         except Exception as e:
             print(f"[ERROR] Player {player_id}: {e}")
         
         finally:
-            with self.lock:
-                if player_id in self.players:
-                    self.players[player_id]["connected"] = False
-                    del self.players[player_id]
-            client_socket.close()
-            print(f"[DISCONNECT] Player {player_id} disconnected")
+            self.unregister_player(player_id)
+            conn.close()
     
     def process_message(self, player_id, message):
+        # Runs on the simulation thread with the lock held
+        player = self.players.get(player_id)
+        if not player:
+            return
         msg_type = message.get("type")
         
         if msg_type == "set_name":
-            with self.lock:
-                if player_id in self.players:
-                    self.players[player_id]["name"] = message.get("name", f"Player{player_id}")
+            name = message.get("name", f"Player{player_id}")
+            if not isinstance(name, str) or not name:
+                # Names end up in binary frames and as profile keys
+                return
+            if name == player["name"]:
+                return
+            if self.names.get(name, player_id) != player_id:
+                self.send_to_player(player["conn"], {"type": "name_taken", "name": name})
+            elif self.shard:
+                # The name may be live on another shard, the hub answers with a name_claim
+                self.shard.claim_name(player_id, name)
+            else:
+                self.rename_player(player_id, name)
+        
+        elif msg_type == "set_codec":
+            codec = message.get("codec")
+            if codec in CODECS:
+                player["conn"].codec = codec
         
         elif msg_type == "action":
             action = message.get("action")
-            with self.lock:
-                player = self.players.get(player_id)
-                if not player:
-                    return
-                
-                if action == "encounter":
-                    encounter = self.generate_encounter()
-                    self.broadcast({
-                        "type": "encounter",
-                        "player": player["name"],
-                        "encounter": encounter
-                    })
+            # Acknowledged in the next stats update so the client can
+            # drop its predictions for everything up to here
+            seq = message.get("seq")
+            if isinstance(seq, int) and seq > player["input_seq"]:
+                player["input_seq"] = seq
+                self.stats_dirty.add(player_id)
+            
+            if action == "encounter":
+                encounter = self.generate_encounter()
+                self.publish(self.island_topics(player), {
+                    "type": "encounter",
+                    "player": player["name"],
+                    "encounter": encounter
+                })
+            
+            elif action == "attack":
+                target_gold = random.randint(10, 50)
+                player["gold"] += target_gold
+                if player["gold"] > 0:
+                    player["kills"] += 1
+                self.leaderboard.update(player_id, player["gold"])
+                self.mark_player_changed(player_id)
+                self.save_profile(player)
+                self.journal_player("attack", player)
                 
-                elif action == "attack":
-                    target_gold = random.randint(10, 50)
-                    player["gold"] += target_gold
-                    if player["gold"] > 0:
-                        player["kills"] += 1
-                    
-                    self.broadcast({
-                        "type": "achievement",
-                        "player": player["name"],
-                        "message": f"Defeated an enemy! +{target_gold} gold"
+                self.publish(self.player_topics(player), {
+                    "type": "achievement",
+                    "player": player["name"],
+                    "message": achievement_text(1, target_gold),
+                    "gold": target_gold,
+                    "kills": 1
+                }, player_id)
+            
+            elif action == "rest":
+                health = player["health"]
+                player["energy"] = min(100, player["energy"] + 40)
+                player["health"] = min(100, player["health"] + 20)
+                self.stats_dirty.add(player_id)
+                if player["health"] != health:
+                    self.mark_player_changed(player_id)
+                self.journal_player("rest", player)
+            
+            elif action == "take_damage":
+                damage = message.get("damage", 10)
+                player["health"] -= damage
+                self.mark_player_changed(player_id)
+                if player["health"] <= 0:
+                    player["health"] = 50
+                    self.publish(self.player_topics(player), {
+                        "type": "death",
+                        "player": player["name"]
                     })
-                
-                elif action == "rest":
-                    player["energy"] = min(100, player["energy"] + 40)
-                    player["health"] = min(100, player["health"] + 20)
-                
-                elif action == "take_damage":
-                    damage = message.get("damage", 10)
-                    player["health"] -= damage
-                    if player["health"] <= 0:
-                        player["health"] = 50
-                        self.broadcast({
-                            "type": "death",
-                            "player": player["name"]
-                        })
+                self.journal_player("take_damage", player)
         
         elif msg_type == "get_leaderboard":
-            with self.lock:
-                leaderboard = sorted(
-                    [(p["name"], p["gold"], p["kills"]) for p in self.players.values()],
-                    key=lambda x: x[1],
-                    reverse=True
-                )
+            limit = max(0, min(int(message.get("limit", LEADERBOARD_SIZE)), MAX_LEADERBOARD_SIZE))
+            if message.get("scope") == "all_time" and self.store:
+                # Everyone who ever played, as of the last flush
+                top = self.store.top_players
+                leaderboard = top[:limit]
+                names = [entry[0] for entry in top]
+                rank = names.index(player["name"]) + 1 if player["name"] in names else 0
+            elif self.global_leaderboard is None:
+                leaderboard = self.top_players(limit)
+                rank = self.leaderboard.rank(player_id) or 0
+            else:
+                # Sharded: the hub's merge of every shard, refreshed each second
+                leaderboard = self.global_leaderboard[:limit]
+                names = [entry[0] for entry in self.global_leaderboard]
+                rank = names.index(player["name"]) + 1 if player["name"] in names else 0
             
-            self.send_to_player(self.players[player_id]["socket"], {
+            self.send_to_player(player["conn"], {
                 "type": "leaderboard",
-                "board": leaderboard
+                "board": leaderboard,
+                "rank": rank
             })
         
         elif msg_type == "get_players":
-            with self.lock:
-                player_list = [
-                    {
-                        "name": p["name"],
-                        "gold": p["gold"],
-                        "health": p["health"],
-                        "level": p["level"]
-                    }
-                    for p in self.players.values()
-                ]
-            
-            self.send_to_player(self.players[player_id]["socket"], {
-                "type": "player_list",
-                "players": player_list
+            self.send_to_player(player["conn"], self.player_list_since(message.get("since")))
+        
+        elif msg_type == "subscribe":
+            self.subscribe(player_id, str(message.get("topic")))
+        
+        elif msg_type == "unsubscribe":
+            self.unsubscribe(player_id, str(message.get("topic")))
+        
+        elif msg_type == "udp_lost":
+            # Their datagrams stopped arriving, back to stats over TCP
+            player["udp_addr"] = None
+            self.stats_dirty.add(player_id)
+    
+    def subscribe(self, player_id, topic):
+        player = self.players[player_id]
+        kind, _, name = topic.partition(":")
+        if kind == "island" and name in ISLANDS:
+            # Travelling: you are only ever on one island
+            if player["island"]:
+                self.topics.unsubscribe(player["island"], player_id)
+            player["island"] = topic
+        elif kind == "party" and 0 < len(name) <= MAX_PARTY_NAME:
+            if player["party"]:
+                self.topics.unsubscribe(player["party"], player_id)
+            player["party"] = topic
+        elif topic != GLOBAL_TOPIC:
+            return
+        self.topics.subscribe(topic, player_id)
+        self.send_subscriptions(player_id)
+    
+    def unsubscribe(self, player_id, topic):
+        player = self.players[player_id]
+        if topic == player["island"]:
+            # Leave an island by travelling to another one
+            return
+        if topic == player["party"]:
+            player["party"] = None
+        self.topics.unsubscribe(topic, player_id)
+        self.send_subscriptions(player_id)
+    
+    def send_subscriptions(self, player_id):
+        self.send_to_player(self.players[player_id]["conn"], {
+            "type": "subscriptions",
+            "topics": sorted(self.topics.topics_of(player_id)),
+            "islands": list(ISLANDS)
+        })
+    
+    def island_topics(self, player):
+        return (player["island"], GLOBAL_TOPIC)
+    
+    def player_topics(self, player):
+        # What happens to a player also reaches their party wherever they are
+        if player["party"]:
+            return (player["island"], player["party"], GLOBAL_TOPIC)
+        return (player["island"], GLOBAL_TOPIC)
+    
+    def name_claimed(self, player_id, name, granted):
+        # The hub's answer to claim_name; if they left meanwhile it was released again
+        player = self.players.get(player_id)
+        if not player:
+            return
+        if granted:
+            self.rename_player(player_id, name)
+        else:
+            self.send_to_player(player["conn"], {"type": "name_taken", "name": name})
+    
+    def rename_player(self, player_id, name):
+        player = self.players[player_id]
+        self.save_profile(player)
+        if self.names.get(player["name"]) == player_id:
+            del self.names[player["name"]]
+        if player["profile"] is not None and (self.store or self.journal):
+            # Everything they have belongs to the profile just saved,
+            # the new name starts from its own profile alone
+            player["gold"] = 0
+            player["kills"] = 0
+            player["level"] = 1
+            self.leaderboard.update(player_id, 0)
+        # With nothing persisted they just keep their progress
+        player["profile"] = None
+        player["name"] = name
+        self.names[name] = player_id
+        self.mark_player_changed(player_id)
+        if self.store:
+            self.load_profile(player_id, name)
+        else:
+            self.apply_profile(player_id, name, None)
+    
+    def load_profile(self, player_id, name):
+        # The lookup runs on the storage thread, the result comes back
+        # through the inbox like any other event
+        self.store.load(name, lambda profile: self.inbox.append(("profile", player_id, (name, profile))))
+    
+    def apply_profile(self, player_id, name, profile):
+        player = self.players.get(player_id)
+        # Stale if they renamed since, and only an anonymous player (never
+        # had a profile, or reset by set_name) has totals to merge into
+        if not player or player["name"] != name or player["profile"] is not None:
+            return
+        journaled = self.journal.state.get(name) if self.journal else None
+        if journaled:
+            # Entries from before they were timestamped count as older than the store
+            journaled_at = journaled[5] if len(journaled) > 5 else 0
+            if not profile or journaled_at >= profile["updated"]:
+                gold, kills, level, health, energy = journaled[:5]
+                player["health"] = health
+                player["energy"] = energy
+                profile = {"gold": gold, "kills": kills, "level": level}
+        if profile:
+            # Keep whatever was earned while the lookup was in flight
+            player["gold"] += profile["gold"]
+            player["kills"] += profile["kills"]
+            player["level"] = max(player["level"], profile["level"])
+            self.leaderboard.update(player_id, player["gold"])
+            self.mark_player_changed(player_id)
+        player["profile"] = name
+        self.save_profile(player)
+        self.journal_player("profile", player)
+    
+    def save_profile(self, player):
+        # Only once the stored profile was merged in, or we would overwrite it
+        if self.store and player["profile"] == player["name"]:
+            self.store.save(player["name"], player["gold"], player["kills"], player["level"])
+    
+    def journal_player(self, action, player):
+        if self.journal and player["profile"] == player["name"]:
+            self.journal.record(action, player["name"], [
+                player["gold"], player["kills"], player["level"], player["health"], player["energy"], time.time()
+            ])
+    
+    def top_players(self, limit):
+        leaderboard = []
+        for top_id in self.leaderboard.top(limit):
+            p = self.players[top_id]
+            leaderboard.append((p["name"], p["gold"], p["kills"]))
+        return leaderboard
+    
+    def mark_player_changed(self, player_id):
+        self.stats_dirty.add(player_id)
+        self.players_version += 1
+        self.player_versions[player_id] = self.players_version
+        self.player_versions.move_to_end(player_id)
+    
+    def player_list_since(self, since=None):
+        """player_list with only what changed after version `since`.
+        
+        Clients without a version, from before the oldest tombstone or from
+        the future (server restarted) get a full snapshot instead.
+        """
+        full = not isinstance(since, int) or not self.tombstone_horizon <= since <= self.players_version
+        if full:
+            changed = list(self.players)
+            removed = []
+        else:
+            changed = []
+            for changed_id, version in reversed(self.player_versions.items()):
+                if version <= since:
+                    break
+                changed.append(changed_id)
+            removed = []
+            for removed_id, version in reversed(self.removed_players.items()):
+                if version <= since:
+                    break
+                removed.append(removed_id)
+        
+        players = []
+        for changed_id in changed:
+            p = self.players[changed_id]
+            players.append({
+                "id": changed_id,
+                "name": p["name"],
+                "gold": p["gold"],
+                "health": p["health"],
+                "level": p["level"]
             })
+        
+        return {
+            "type": "player_list",
+            "version": self.players_version,
+            "full": full,
+            "players": players,
+            "removed": removed
+        }
     
     def generate_encounter(self):
         encounters = [
@@ -200,80 +832,265 @@ class GameServer:
         ]
         return random.choice(encounters)
     
-    def broadcast(self, message):
-        with self.lock:
-            for player in self.players.values():
+    def publish(self, topics, message, player_id=None):
+        # Held until the end of the tick so events can be merged first,
+        # achievements per player_id
+        self.tick_events.append((topics, message, player_id))
+        if self.metrics.enabled:
+            self.metrics.count(f"published.{message['type']}")
+    
+    def send_to_player(self, conn, message):
+        pending = self.outbox.get(conn)
+        if pending is None:
+            pending = self.outbox[conn] = []
+        pending.append(message)
+        if self.metrics.enabled:
+            self.metrics.count(f"sent.{message['type']}")
+    
+    def send_stats(self, refresh=False):
+        """Each player's own stats, numbered so the client keeps only the newest"""
+        udp_bytes = 0
+        for player_id, player in self.players.items():
+            if player_id not in self.stats_dirty and not (refresh and player["udp_addr"]):
+                continue
+            player["stats_seq"] += 1
+            message = {
+                "type": "stats",
+                "seq": player["stats_seq"],
+                "ack": player["input_seq"],
+                "health": player["health"],
+                "energy": player["energy"],
+                "gold": player["gold"],
+                "kills": player["kills"],
+                "level": player["level"]
+            }
+            if player["udp_addr"]:
+                payload = encode_payload(message, player["conn"].codec)
                 try:
-                    self.send_to_player(player["socket"], message)
-                except:
+                    # A full socket buffer drops the datagram instead of stalling the tick
+                    self.udp.sendto(payload, socket.MSG_DONTWAIT, player["udp_addr"])
+                    udp_bytes += len(payload)
+                except OSError:
                     pass
+            else:
+                self.send_to_player(player["conn"], message)
+        self.stats_dirty.clear()
+        if self.metrics.enabled and udp_bytes:
+            self.metrics.count("udp_bytes_out", udp_bytes)
     
-    def send_to_player(self, client_socket, message):
-        try:
-            client_socket.send(json.dumps(message).encode())
-        except:
-            pass
-    
-    def run_dashboard(self):
-        while self.running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-            
-            self.draw_dashboard()
-            pygame.display.flip()
-            self.clock.tick(30)
+    def flush_outbox(self):
+        """Send everything from this tick in one write per client"""
+        if self.metrics.enabled:
+            start = time.perf_counter()
         
-        pygame.quit()
-    
-    def draw_dashboard(self):
-        self.screen.fill(BLACK)
+        events = coalesce_events(self.tick_events)
+        if self.metrics.enabled:
+            self.metrics.count("events_coalesced", len(self.tick_events) - len(events))
+        self.tick_events = []
+        if self.shard and events:
+            self.shard.publish_events(events)
+        if self.remote_events:
+            # Already merged by the shard they came from
+            events.extend(self.remote_events)
+            self.remote_events = []
+        outbox, self.outbox = self.outbox, {}
         
-        # Title
-        title = self.font_large.render("Game Server Dashboard", True, CYAN)
-        self.screen.blit(title, (20, 10))
+        # Events published to the same topics share one audience lookup and
+        # are serialized once per codec. Order is kept within a group.
+        groups = {}
+        for topics, message in events:
+            groups.setdefault(topics, []).append(message)
         
-        # Server info
-        uptime = int(time.time() - self.start_time)
-        uptime_text = self.font_small.render(f"Uptime: {uptime}s | Port: {self.port}", True, YELLOW)
-        self.screen.blit(uptime_text, (20, 70))
+        conn_groups = {}
+        fanout = 0
+        for topics, messages in groups.items():
+            group = (messages, {}, any(message["type"] in CRITICAL_MESSAGES for message in messages))
+            audience = self.topics.audience(topics)
+            fanout += len(audience) * len(messages)
+            for member in audience:
+                conn = self.players[member]["conn"]
+                followed = conn_groups.get(conn)
+                if followed is None:
+                    conn_groups[conn] = [group]
+                else:
+                    followed.append(group)
+        
+        recipients = list(outbox)
+        recipients.extend(conn for conn in conn_groups if conn not in outbox)
+        
+        for conn in recipients:
+            frames = []
+            critical = False
+            for message in latest_replies(outbox.get(conn, [])):
+                frames.append(encode_message(message, conn.codec))
+                critical = critical or message["type"] in CRITICAL_MESSAGES
+            
+            for messages, encoded, group_critical in conn_groups.get(conn, ()):
+                shared = encoded.get(conn.codec)
+                if shared is None:
+                    shared = encoded[conn.codec] = [encode_message(message, conn.codec) for message in messages]
+                frames.extend(shared)
+                critical = critical or group_critical
+            
+            # One send queue entry, and so one write, per client per tick
+            conn.send(encode_batch(frames), critical)
         
-        # Player stats
+        if self.metrics.enabled and fanout:
+            self.metrics.count("events_delivered", fanout)
+        if self.metrics.enabled and recipients:
+            self.metrics.count("batches", len(recipients))
+            self.metrics.observe("flush", time.perf_counter() - start)
+    
+    def stats(self):
         with self.lock:
             total_players = len(self.players)
             total_gold = sum(p.get("gold", 0) for p in self.players.values())
             total_kills = sum(p.get("kills", 0) for p in self.players.values())
+            conns = [p["conn"] for p in self.players.values()] if self.metrics.enabled else []
+            # The simulation thread only updates metrics while holding the lock
+            metrics = self.metrics.snapshot() if self.metrics.enabled else {}
         
-        stats_y = 120
-        stats = [
-            f"Connected Players: {total_players}",
-            f"Total Gold Earned: {total_gold}",
-            f"Total Kills: {total_kills}"
-        ]
-        
-        for stat in stats:
-            text = self.font_medium.render(stat, True, GREEN)
-            self.screen.blit(text, (20, stats_y))
-            stats_y += 50
-        
-        # Player list
-        players_y = 350
-        header = self.font_medium.render("Online Players:", True, WHITE)
-        self.screen.blit(header, (20, players_y))
-        players_y += 40
+        stats = {
+            "backend": self.backend,
+            "uptime": int(time.time() - self.start_time),
+            "players": total_players,
+            "total_gold": total_gold,
+            "total_kills": total_kills,
+        }
+        if resource:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            stats["cpu_seconds"] = round(usage.ru_utime + usage.ru_stime, 3)
+            stats["max_rss_kb"] = usage.ru_maxrss
         
-        with self.lock:
-            for player_id, player in sorted(self.players.items()):
-                info = f"[{player_id}] {player['name']} - Gold: {player['gold']} | Health: {player['health']}/100 | Kills: {player['kills']}"
-                text = self.font_small.render(info, True, PURPLE)
-                self.screen.blit(text, (40, players_y))
-                players_y += 30
-        
-        # Legend
-        legend_y = self.HEIGHT - 40
-        legend = self.font_small.render("Close this window to stop the server", True, LIGHT_GREY)
-        self.screen.blit(legend, (20, legend_y))
-
+        if self.metrics.enabled:
+            stats.update(metrics)
+            # Closed connections were folded into the counters, add the live ones
+            stats["connections"] = len(conns)
+            stats["ticks"] = self.ticks
+            stats["inbox_depth"] = len(self.inbox)
+            stats["bytes_in"] = stats.get("bytes_in", 0) + sum(c.bytes_in for c in conns)
+            stats["bytes_out"] = stats.get("bytes_out", 0) + sum(c.bytes_out for c in conns)
+            stats["dropped_messages"] = stats.get("dropped_messages", 0) + sum(c.dropped for c in conns)
+            stats["rate_limited"] = stats.get("rate_limited", 0) + sum(c.rate_limited for c in conns)
+            depths = [len(c.queue) for c in conns]
+            stats["send_queue_depth.total"] = sum(depths)
+            stats["send_queue_depth.max"] = max(depths, default=0)
+        if self.store:
+            stats["store.flushes"] = self.store.flushes
+            stats["store.rows_written"] = self.store.rows_written
+            stats["store.last_flush_us"] = int(self.store.flush_seconds * 1e6)
+            stats["store.pending_loads"] = self.store.loads.qsize()
+        if self.journal:
+            stats["journal.records"] = self.journal.records
+            stats["journal.snapshots"] = self.journal.snapshots
+            stats["journal.pending_batches"] = self.journal.batches.qsize()
+        return stats
+    
+    def format_stats(self):
+        return "".join(f"{key} {value}\n" for key, value in self.stats().items())
+    
+    def log_metrics(self):
+        previous = self.stats()
+        while self.running:
+            time.sleep(self.metrics_interval)
+            stats = self.stats()
+            messages = sum(v for k, v in stats.items() if k.startswith("messages."))
+            last_messages = sum(v for k, v in previous.items() if k.startswith("messages."))
+            print(
+                f"[METRICS] players={stats['players']}"
+                f" msgs/s={(messages - last_messages) / self.metrics_interval:.0f}"
+                f" tick_p99={stats.get('tick.p99_us', 0)}us"
+                f" lock_wait_p99={stats.get('lock_wait.p99_us', 0)}us"
+                f" in={(stats['bytes_in'] - previous['bytes_in']) / self.metrics_interval / 1024:.1f}KB/s"
+                f" out={(stats['bytes_out'] - previous['bytes_out']) / self.metrics_interval / 1024:.1f}KB/s"
+                f" inbox={stats['inbox_depth']}"
+                f" send_queue_max={stats['send_queue_depth.max']}"
+                f" dropped={stats['dropped_messages']}"
+                f" rate_limited={stats['rate_limited']}"
+            )
+            previous = stats
+    
+    def serve_stats(self):
+        # Plain text stats endpoint: connect, read "key value" lines, done
+        # e.g. nc localhost 5556
+        stats_server = socket.create_server((self.host, self.stats_port))
+        stats_server.settimeout(1)
+        print(f"[SERVER] Stats on {self.host}:{self.stats_port}")
+        with stats_server:
+            while self.running:
+                try:
+                    client_socket, _ = stats_server.accept()
+                except socket.timeout:
+                    continue
+                with client_socket:
+                    try:
+                        client_socket.sendall(self.format_stats().encode())
+                    except OSError:
+                        pass
+    
 if __name__ == "__main__":
-    server = GameServer()
-    server.start()
+    parser = argparse.ArgumentParser(description="Island Adventure multiplayer server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--backend", choices=BACKENDS, default="threads",
+                        help="threads: one OS thread per player, asyncio: one task per player on a single thread")
+    parser.add_argument("--send-queue", type=int, default=SEND_QUEUE_SIZE,
+                        help="outbound batches (one per tick) queued per player before the slow client policy kicks in")
+    parser.add_argument("--slow-client-policy", choices=SLOW_CLIENT_POLICIES, default="drop_oldest")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the pygame dashboard (pygame is never imported)")
+    parser.add_argument("--stats-port", type=int,
+                        help="serve plain text stats on this port")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                        help="simulation ticks per second, queued actions are applied once per tick")
+    parser.add_argument("--metrics", action="store_true",
+                        help="collect message counters and latency histograms (shown on the stats port)")
+    parser.add_argument("--metrics-interval", type=float,
+                        help="print a metrics summary line every N seconds (implies --metrics)")
+    parser.add_argument("--rate-limit", type=parse_rate_limits, default=parse_rate_limits(DEFAULT_RATE_LIMITS),
+                        help=f"per connection token buckets as kind=rate/burst,..., 'message' covers everything, "
+                             f"'off' disables them, default {DEFAULT_RATE_LIMITS}")
+    parser.add_argument("--rate-limit-policy", choices=RATE_LIMIT_POLICIES, default="drop",
+                        help="drop messages over the limit, or defer them and stop reading from the client")
+    parser.add_argument("--udp-port", type=int,
+                        help="also send stats updates over UDP on this port, clients fall back to TCP")
+    parser.add_argument("--db", help="SQLite file for persistent player profiles")
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL,
+                        help="seconds between batched profile writes")
+    parser.add_argument("--journal", help="directory for the crash recovery journal and snapshots")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default="interval",
+                        help="fsync the journal after every tick's batch, once a second, or never")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY,
+                        help="journal records between snapshots")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="run this many headless worker processes sharing the port (Linux SO_REUSEPORT)")
+    args = parser.parse_args()
+    
+    options = {
+        "host": args.host,
+        "port": args.port,
+        "backend": args.backend,
+        "send_queue_size": args.send_queue,
+        "slow_client_policy": args.slow_client_policy,
+        "headless": args.headless,
+        "stats_port": args.stats_port,
+        "tick_rate": args.tick_rate,
+        "metrics": args.metrics,
+        "metrics_interval": args.metrics_interval,
+        "db_path": args.db,
+        "flush_interval": args.flush_interval,
+        "rate_limits": args.rate_limit,
+        "rate_limit_policy": args.rate_limit_policy,
+        "udp_port": args.udp_port,
+        "journal_dir": args.journal,
+        "journal_fsync": args.fsync,
+        "snapshot_every": args.snapshot_every,
+    }
+    if args.shards > 1:
+        from shards import run_sharded
+        run_sharded(args.shards, options)
+    else:
+        server = GameServer(**options)
+        # Stop like Ctrl+C so the player store gets its final flush
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(server, "running", False))
+        server.start()
@@ -0,0 +1,146 @@
+import heapq
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+from multiprocessing.connection import wait
+
+from server import GameServer, MAX_LEADERBOARD_SIZE
+
+
+class ShardLink:
+    """Worker side of the cross-shard channel.
+
+    Each worker process runs its own GameServer on a SO_REUSEPORT listener,
+    so the kernel spreads new connections over the shards and every player
+    lives on exactly one of them. The link forwards the shard's events and
+    top players to the hub, and feeds what the hub sends back into the
+    server inbox so it is applied on the next tick like everything else.
+    """
+
+    def __init__(self, index, count, channel):
+        self.index = index
+        self.count = count
+        self.channel = channel
+        self.send_lock = threading.Lock()
+
+    def attach(self, server):
+        threading.Thread(target=self.receive, args=(server,), daemon=True).start()
+
+    def receive(self, server):
+        try:
+            while True:
+                kind, data = self.channel.recv()
+                server.inbox.append((kind, None, data))
+        except (EOFError, OSError):
+            print(f"[SHARD {self.index}] Lost the hub, stopping")
+            server.running = False
+
+    def send(self, kind, data):
+        with self.send_lock:
+            self.channel.send((kind, data))
+
+    def publish_events(self, events):
+        self.send("events", events)
+
+    def publish_leaderboard(self, board):
+        self.send("leaderboard", board)
+
+    def claim_name(self, player_id, name):
+        self.send("claim_name", (player_id, name))
+
+    def release_name(self, player_id):
+        self.send("release_name", player_id)
+
+
+def run_worker(index, count, channel, options):
+    server = GameServer(**options, shard=ShardLink(index, count, channel))
+    # Stop like Ctrl+C so the player store gets its final flush
+    signal.signal(signal.SIGTERM, lambda signum, frame: setattr(server, "running", False))
+    server.start()
+
+
+def run_hub(channels):
+    """Relay events between shards, merge their leaderboards and own the names"""
+    boards = {}
+    # Which (channel, player ID) holds each name, and the other way round
+    names = {}
+    claims = {}
+    while channels:
+        for channel in wait(channels):
+            try:
+                kind, data = channel.recv()
+            except (EOFError, OSError):
+                channels.remove(channel)
+                boards.pop(channel, None)
+                for owner in [owner for owner in claims if owner[0] is channel]:
+                    del names[claims.pop(owner)]
+                continue
+
+            if kind == "events":
+                for other in channels:
+                    if other is not channel:
+                        other.send(("remote_events", data))
+
+            elif kind == "leaderboard":
+                # Each shard sends its own top players sorted by gold
+                boards[channel] = data
+                merged = list(heapq.merge(*boards.values(), key=lambda entry: -entry[1]))
+                merged = merged[:MAX_LEADERBOARD_SIZE]
+                for other in channels:
+                    other.send(("global_leaderboard", merged))
+
+            elif kind == "claim_name":
+                player_id, name = data
+                owner = (channel, player_id)
+                granted = names.get(name, owner) == owner
+                if granted:
+                    old = claims.pop(owner, None)
+                    if old is not None:
+                        del names[old]
+                    names[name] = owner
+                    claims[owner] = name
+                channel.send(("name_claim", (player_id, name, granted)))
+
+            elif kind == "release_name":
+                name = claims.pop((channel, data), None)
+                if name is not None:
+                    del names[name]
+
+
+def run_sharded(count, options):
+    # Spawn rather than fork so a worker does not inherit the hub's ends of
+    # its siblings' pipes, which would keep it alive after the hub is gone
+    context = multiprocessing.get_context("spawn")
+    channels = []
+    workers = []
+    for index in range(count):
+        hub_end, worker_end = context.Pipe()
+        worker_options = dict(options, headless=True)
+        if options.get("stats_port"):
+            worker_options["stats_port"] = options["stats_port"] + index
+        if options.get("journal_dir"):
+            worker_options["journal_dir"] = os.path.join(options["journal_dir"], f"shard-{index}")
+        if options.get("udp_port"):
+            # Datagrams are not tied to a connection, so each shard needs its own port
+            worker_options["udp_port"] = options["udp_port"] + index
+        worker = context.Process(
+            target=run_worker, args=(index, count, worker_end, worker_options), daemon=True
+        )
+        worker.start()
+        worker_end.close()
+        channels.append(hub_end)
+        workers.append(worker)
+
+    # Let a plain kill stop the workers too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"[HUB] Running {count} shards on port {options['port']}")
+    try:
+        run_hub(channels)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
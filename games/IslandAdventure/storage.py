@@ -0,0 +1,129 @@
+import queue
+import sqlite3
+import threading
+import time
+
+FLUSH_INTERVAL = 5.0
+TOP_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    gold INTEGER NOT NULL DEFAULT 0,
+    kills INTEGER NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 1,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_by_gold ON players (gold DESC);
+"""
+
+UPSERT = """
+INSERT INTO players (name, gold, kills, level, updated) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET
+    gold = excluded.gold, kills = excluded.kills, level = excluded.level, updated = excluded.updated
+"""
+
+
+class PlayerStore:
+    """Player profiles in SQLite behind a write-behind cache.
+
+    The game only ever calls save() and load(), which touch a dict or a
+    queue and return at once. A single storage thread owns the database:
+    it answers loads and writes every dirty profile in one transaction each
+    flush interval, then refreshes the all-time top list from the gold index.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.dirty = {}
+        self.dirty_lock = threading.Lock()
+        self.loads = queue.Queue()
+        self.top_players = []
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_seconds = 0.0
+        self.closing = False
+        self.thread = None
+
+    def start(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets readers (and other shards) in while a flush is writing
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        db.executescript(SCHEMA)
+        self.refresh_top(db)
+        self.thread = threading.Thread(target=self.run, args=(db,), daemon=True)
+        self.thread.start()
+
+    def save(self, name, gold, kills, level):
+        # Only the latest state per player is kept until the next flush,
+        # stamped with when it happened rather than when it gets written
+        with self.dirty_lock:
+            self.dirty[name] = (gold, kills, level, time.time())
+
+    def load(self, name, callback):
+        """Look up a profile off the game thread, callback(profile or None) runs on the storage thread"""
+        self.loads.put((name, callback))
+
+    def close(self):
+        # Stops the storage thread after a final flush
+        if self.thread:
+            self.closing = True
+            self.loads.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def run(self, db):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0, next_flush - time.monotonic())
+            try:
+                request = self.loads.get(timeout=timeout)
+            except queue.Empty:
+                request = None
+
+            if request:
+                name, callback = request
+                callback(self.fetch(db, name))
+                continue
+            if time.monotonic() >= next_flush or self.closing:
+                self.flush(db)
+                next_flush = time.monotonic() + self.flush_interval
+            if self.closing:
+                break
+        db.close()
+
+    def fetch(self, db, name):
+        # Unflushed changes are newer than the database
+        with self.dirty_lock:
+            pending = self.dirty.get(name)
+        if pending is None:
+            row = db.execute("SELECT gold, kills, level, updated FROM players WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            pending = row
+        gold, kills, level, updated = pending
+        return {"gold": gold, "kills": kills, "level": level, "updated": updated}
+
+    def flush(self, db):
+        with self.dirty_lock:
+            dirty, self.dirty = self.dirty, {}
+        if not dirty:
+            return
+
+        start = time.perf_counter()
+        rows = [(name, *profile) for name, profile in dirty.items()]
+        with db:
+            db.executemany(UPSERT, rows)
+        self.refresh_top(db)
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self.flush_seconds = time.perf_counter() - start
+
+    def refresh_top(self, db):
+        # Replaced in one assignment, readers never see a half-built list
+        self.top_players = db.execute(
+            "SELECT name, gold, kills FROM players ORDER BY gold DESC LIMIT ?", (TOP_SIZE,)
+        ).fetchall()
@@ -0,0 +1,37 @@
+import collections
+
+TEXT_CACHE_SIZE = 512
+
+
+class TextCache:
+    """Rendered text surfaces keyed by (font, text, color).
+
+    Most of what the client and dashboard draw is the same from one frame
+    to the next, so font.render only runs for text that changed. The least
+    recently drawn surface is dropped once the cache is full.
+    """
+
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, color, antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        if self.size:
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.size:
+                self.surfaces.popitem(last=False)
+        return surface
@@ -0,0 +1,66 @@
+import collections
+
+EMPTY = frozenset()
+
+
+class TopicIndex:
+    """Who follows which topic, indexed both ways.
+
+    subscribers maps a topic to the set of members following it and
+    topics maps a member back to its topics, so subscribing, unsubscribing
+    and dropping a member touch only the sets involved. Topics nobody
+    follows are deleted instead of piling up.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.topics = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self, topic, member):
+        members = self.subscribers.get(topic)
+        if members is None:
+            members = self.subscribers[topic] = set()
+        members.add(member)
+        self.topics[member].add(topic)
+
+    def unsubscribe(self, topic, member):
+        members = self.subscribers.get(topic)
+        if members is None:
+            return
+        members.discard(member)
+        if not members:
+            del self.subscribers[topic]
+        topics = self.topics.get(member)
+        if topics is not None:
+            topics.discard(topic)
+            if not topics:
+                del self.topics[member]
+
+    def remove(self, member):
+        for topic in self.topics.pop(member, ()):
+            members = self.subscribers[topic]
+            members.discard(member)
+            if not members:
+                del self.subscribers[topic]
+
+    def topics_of(self, member):
+        return self.topics.get(member, EMPTY)
+
+    def count(self, topic):
+        return len(self.subscribers.get(topic, EMPTY))
+
+    def audience(self, topics):
+        """Everyone following at least one of the topics, each member once.
+
+        The common case of a single non-empty topic returns its set as is,
+        so callers must not change the result.
+        """
+        sets = [self.subscribers[topic] for topic in topics if topic in self.subscribers]
+        if not sets:
+            return EMPTY
+        if len(sets) == 1:
+            return sets[0]
+        return set().union(*sets)